@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Alternative service core: runs the background service as asyncio event loop on the updater thread.
+    All periodic work runs as tasks on a single loop, the blocking xbmc/JSON-RPC calls
+    go through a bounded thread pool executor with a timeout.
+    On stop all tasks are cancelled.
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .utils import log_msg, log_exception
+import xbmc
+
+MAX_WORKERS = 4  # max number of blocking calls running at the same time
+TASK_TIMEOUT = 120  # timeout in seconds for a single blocking call
+
+
+class AsyncServiceCore(object):
+    '''asyncio based core of the background service'''
+
+    def __init__(self, bgupdater):
+        self.bgupdater = bgupdater
+        self.loop = None
+        self.main_task = None
+        self.active = True
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+    def run(self):
+        '''run the event loop until stopped, blocks the calling thread'''
+        log_msg("BackgroundsUpdater - running asyncio core", xbmc.LOGINFO)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.main_task = self.loop.create_task(self.main())
+            self.loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            log_exception(__name__, exc)
+        finally:
+            # blocking calls which are still running can't be interrupted, do not wait for them
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+    def stop(self):
+        '''cancel all tasks, can be called from any thread'''
+        if self.loop and self.main_task and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self.main_task.cancel)
+            except RuntimeError:
+                # loop closed in the meanwhile
+                pass
+
+    async def run_blocking(self, func, *args):
+        '''run a blocking call in the bounded executor, with timeout'''
+        return await asyncio.wait_for(self.loop.run_in_executor(self.executor, func, *args), TASK_TIMEOUT)
+
+    async def main(self):
+        '''start all periodic tasks and cancel them all when one of them (or main) is cancelled'''
+        tasks = [
+            self.loop.create_task(self.state_task()),
+            self.loop.create_task(self.delayed_task()),
+            self.loop.create_task(self.backgrounds_task()),
+            self.loop.create_task(self.walls_task())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def state_task(self):
+        '''every second: check if we're active, the playback state and the requests from the skin'''
+        while not self.bgupdater.exit:
+            await self.guarded(self.check_state)
+            await asyncio.sleep(1)
+
+    def check_state(self):
+        '''check if we're active, the playback state and the requests from the skin (blocking)'''
+        self.active = self.bgupdater.is_active()
+        if self.active:
+            self.bgupdater.handle_requests()
+        self.bgupdater.check_resources()
+
+    async def delayed_task(self):
+        '''background stuff like reading the skin settings and generating smart shortcuts'''
+        await asyncio.sleep(8)
+        while not self.bgupdater.exit:
+            if self.active:
+                await self.guarded(self.bgupdater.get_config)
+                await self.guarded(self.bgupdater.update_demand)
+                await self.guarded(self.bgupdater.update_cond_background, True)
+                await self.guarded(self.bgupdater.report_allbackgrounds)
+                await self.build_smartshortcuts()
+            await asyncio.sleep(120)
+
+    async def build_smartshortcuts(self):
+        '''run all smart shortcuts providers concurrently'''
+        smartshortcuts = self.bgupdater.smartshortcuts
+        if not smartshortcuts.start_build():
+            return
+        try:
+            await asyncio.gather(*[self.guarded(provider) for provider in smartshortcuts.get_providers()])
+        finally:
+            await self.guarded(smartshortcuts.finish_build)
+
+    async def backgrounds_task(self):
+        '''update the backgrounds every interval (if enabled by skinner)'''
+        while not self.bgupdater.exit:
+            # the interval is scaled to the system load by the governor
+            backgrounds_delay = self.bgupdater.governor.rotation_delay(self.bgupdater.backgrounds_delay)
+            if self.active and backgrounds_delay:
+                await self.update_backgrounds()
+                await asyncio.sleep(backgrounds_delay)
+            else:
+                await asyncio.sleep(1)
+
+    async def update_backgrounds(self):
+        '''update all our provided backgrounds, the fetches for the backgrounds run concurrently'''
+        bgupdater = self.bgupdater
+        await self.guarded(bgupdater.update_cond_background)
+        backgrounds = await self.guarded(bgupdater.get_backgrounds) or []
+        # backgrounds which are not used by the skin are only rotated lazily
+        bgupdater.demand.next_tick()
+        backgrounds = [background for background in backgrounds if bgupdater.demand.is_due(background[0])]
+        # the number of concurrent fetches depends on the system load
+        semaphore = asyncio.Semaphore(bgupdater.governor.prefetch_concurrency())
+
+        async def set_background(win_prop, lib_path, label):
+            async with semaphore:
+                await self.guarded(bgupdater.set_background, win_prop, lib_path, "", label)
+        await asyncio.gather(*[set_background(win_prop, lib_path, label)
+                               for win_prop, lib_path, label in backgrounds])
+        # the global backgrounds pick from the other backgrounds so they're updated last
+        for win_prop, keys, label in bgupdater.get_global_backgrounds():
+            if bgupdater.demand.is_due(win_prop):
+                await self.guarded(bgupdater.set_global_background, win_prop, keys, "", label)
+
+    async def walls_task(self):
+        '''update the wall images every interval (if enabled by skinner)'''
+        while not self.bgupdater.exit:
+            if self.active and self.bgupdater.enable_walls and self.bgupdater.walls_delay:
+                await self.guarded(self.bgupdater.update_walls)
+                await asyncio.sleep(self.bgupdater.walls_delay)
+            else:
+                await asyncio.sleep(1)
+
+    async def guarded(self, func, *args):
+        '''run a blocking call, errors and timeouts are logged so the calling task keeps running'''
+        try:
+            return await self.run_blocking(func, *args)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            log_msg("Task %s timed out" % func.__name__, xbmc.LOGWARNING)
+        except Exception as exc:
+            log_exception(__name__, exc)
+        return None
@@ -8,39 +8,45 @@
 
 import threading
 import random
-import os, sys
-if sys.version_info.major == 3:
-    import _thread as thread
-else:
-    import thread
-from datetime import timedelta
-from .utils import log_msg, log_exception, get_content_path, urlencode, ADDON_ID
+import os
+import time
+import hashlib
+from datetime import datetime, timedelta
+from .utils import log_msg, log_sampled, log_exception, set_debug_logging, dump_log_buffer, get_content_path, get_source_key, urlencode, ADDON_ID
 import xbmc
 import xbmcvfs
 import xbmcaddon
 import xbmcgui
 from simplecache import SimpleCache
-from .conditional_backgrounds import get_cond_background
+from .conditional_backgrounds import get_cond_schedule
 from .smartshortcuts import SmartShortCuts
 from .wallimages import WallImages
+from .wall_effects import WALL_EFFECTS, parse_color
+from .pools import PoolStore
+from .derivatives import DerivativeCache
+from .colors import ColorIndex, EMPTY_COLORS
+from .governor import ResourceGovernor
+from .demand import DemandRegistry
+from .shared_store import SharedStore
 from metadatautils import MetadataUtils
 
+NEGATIVE_CACHE_MIN = 60  # retry interval in seconds for a path which returned no images
+NEGATIVE_CACHE_MAX = 3600  # the retry interval doubles on every failure up to this maximum
+POOL_SNAPSHOT_MAX_AGE = 600  # pool snapshots of other clients in the shared store are used up to this age
+
 
 class BackgroundsUpdater(threading.Thread):
     '''Background service providing rotating backgrounds to Kodi skins'''
     exit = False
     event = None
-    all_backgrounds = {}
-    all_backgrounds2 = {}
-    all_backgrounds_labels = []
     backgrounds_delay = 0
     walls_delay = 30
     enable_walls = False
-    all_backgrounds_keys = {}
     prefetch_images = 30  # number of images to cache in memory for each library path
     pvr_bg_recordingsonly = False
     custom_picturespath = ""
-    winprops = {}
+    async_core = None
+    shared_store = None
 
     def __init__(self, *args, **kwargs):
         self.cache = SimpleCache()
@@ -49,18 +55,43 @@ class BackgroundsUpdater(threading.Thread):
         self.addon = xbmcaddon.Addon(ADDON_ID)
         self.smartshortcuts = SmartShortCuts(self)
         self.wallimages = WallImages(self)
+        self.derivatives = DerivativeCache()
+        self.colors = ColorIndex(self)
+        self.governor = ResourceGovernor()
+        self.demand = DemandRegistry()
         self.kodimonitor = kwargs.get("kodimonitor")
+        self.kodimonitor.bgupdater = self
+        # the state below is used concurrently by the async core
+        self.lock = threading.RLock()
+        self.negative_cache = {}
+        self.winprops = {}
+        self.all_backgrounds_keys = {}  # win_prop --> lib_path
+        self.all_backgrounds_labels = []
+        self.pool_store = PoolStore()
+        self.pvr_cache = None  # (widgetreload2 token, recordings only, images) of the last pvr fetch
+        self.shared_snapshots = {}  # name --> manifest time of the last pool snapshot seen in the shared store
+        self.global_next = {}  # global win_prop --> the image announced as next image
+        self.announced = {}  # win_prop --> (fanart, path) announced as next image, the skin preloaded that path
+        self.cond_schedule = None
+        self.cond_transition = None
         self.event = threading.Event()
         threading.Thread.__init__(self, *args)
 
     def stop(self):
         '''stop running our background service '''
         self.smartshortcuts.exit = True
-        self.wallimages.exit = True
+        self.wallimages.stop()
+        self.derivatives.stop()
+        self.colors.stop()
         self.exit = True
         self.event.set()
         self.event.clear()
-        self.join(0.5)
+        if self.async_core:
+            # cancel all tasks and wait for the event loop to finish
+            self.async_core.stop()
+            self.join(5)
+        else:
+            self.join(0.5)
         del self.smartshortcuts
         del self.wallimages
         del self.win
@@ -71,6 +102,12 @@ class BackgroundsUpdater(threading.Thread):
         log_msg("BackgroundsUpdater - started", xbmc.LOGINFO)
         self.winpropcache()
         self.get_config()
+        if self.addon.getSetting("use_async_core") == "true":
+            # alternative core: asyncio event loop on this thread
+            from .async_core import AsyncServiceCore
+            self.async_core = AsyncServiceCore(self)
+            self.async_core.run()
+            return
         backgrounds_task_interval = 0
         walls_task_interval = 0
         delayed_task_interval = 112
@@ -78,30 +115,22 @@ class BackgroundsUpdater(threading.Thread):
         while not self.exit:
 
             # Process backgrounds only if we're not watching fullscreen video
-            if xbmc.getCondVisibility(
-                "![Window.IsActive(fullscreenvideo) | Window.IsActive(script.pseudotv.TVOverlay.xml) | "
-                    "Window.IsActive(script.pseudotv.live.TVOverlay.xml)] | "
-                    "Window.IsActive(script.pseudotv.live.EPG.xml)"):
+            if self.is_active():
 
                 # background stuff like reading the skin settings and generating smart shortcuts
                 if delayed_task_interval >= 120:
                     delayed_task_interval = 0
-                    self.get_config()
-                    self.report_allbackgrounds()
-                    self.smartshortcuts.build_smartshortcuts()
-                    self.report_allbackgrounds()
-                    self.winpropcache(True)
+                    self.delayed_tasks()
                     
                 if self.exit:
                     break
 
-                # force refresh smart shortcuts on request
-                if self.win.getProperty("refreshsmartshortcuts"):
-                    self.win.clearProperty("refreshsmartshortcuts")
-                    self.smartshortcuts.build_smartshortcuts()
+                self.handle_requests()
 
                 # Update home backgrounds every interval (if enabled by skinner)
-                if self.backgrounds_delay and backgrounds_task_interval >= self.backgrounds_delay:
+                # the interval is scaled to the system load by the governor
+                backgrounds_delay = self.governor.rotation_delay(self.backgrounds_delay)
+                if backgrounds_delay and backgrounds_task_interval >= backgrounds_delay:
                     backgrounds_task_interval = 0
                     self.update_backgrounds()
                     
@@ -111,16 +140,71 @@ class BackgroundsUpdater(threading.Thread):
                 # Update wall images every interval (if enabled by skinner)
                 if self.enable_walls and self.walls_delay and (walls_task_interval >= self.walls_delay):
                     walls_task_interval = 0
-                    thread.start_new_thread(self.wallimages.update_wallbackgrounds, ())
-                    self.wallimages.update_manualwalls()
+                    self.update_walls()
 
+            self.check_resources()
             self.kodimonitor.waitForAbort(1)
             backgrounds_task_interval += 1
             walls_task_interval += 1
             delayed_task_interval += 1
 
+    @staticmethod
+    def is_active():
+        '''returns True if the backgrounds should be processed (we're not watching fullscreen video)'''
+        return xbmc.getCondVisibility(
+            "![Window.IsActive(fullscreenvideo) | Window.IsActive(script.pseudotv.TVOverlay.xml) | "
+            "Window.IsActive(script.pseudotv.live.TVOverlay.xml)] | "
+            "Window.IsActive(script.pseudotv.live.EPG.xml)")
+
+    def delayed_tasks(self):
+        '''background stuff like reading the skin settings and generating smart shortcuts'''
+        self.get_config()
+        self.update_demand()
+        self.update_cond_background(True)
+        self.report_allbackgrounds()
+        # the build runs in the background, the smart shortcuts are reported when it is finished
+        self.smartshortcuts.build_smartshortcuts()
+
+    def update_demand(self):
+        '''update the backgrounds in demand, the manual walls sample from the pool of their background'''
+        with self.wallimages.lock:
+            manual_walls = list(self.wallimages.manual_walls.keys())
+        self.demand.update([background[0] for background in self.get_backgrounds()],
+                           self.get_global_backgrounds(), manual_walls)
+
+    def handle_requests(self):
+        '''handle the requests from the skin/settings passed in window props'''
+        # write the recent debug events to the log on request
+        if self.win.getProperty("SkinHelper.Backgrounds.DumpLog"):
+            self.win.clearProperty("SkinHelper.Backgrounds.DumpLog")
+            dump_log_buffer()
+
+        # force refresh smart shortcuts on request
+        if self.win.getProperty("refreshsmartshortcuts"):
+            self.win.clearProperty("refreshsmartshortcuts")
+            self.smartshortcuts.build_smartshortcuts()
+
+    def update_walls(self):
+        '''update the wall images'''
+        self.wallimages.update_wallbackgrounds()
+        self.wallimages.update_manualwalls()
+
+    def check_resources(self):
+        '''update the load level, the workers are paused during playback, library scans or high cpu load'''
+        self.governor.update()
+        if not self.governor.allow_background_work():
+            self.wallimages.pause()
+            self.derivatives.worker.pause()
+            self.colors.worker.pause()
+        else:
+            self.wallimages.resume()
+            self.derivatives.worker.resume()
+            self.colors.worker.resume()
+
     def get_config(self):
         '''gets various settings for the script as set by the skinner or user'''
+        set_debug_logging(xbmc.getCondVisibility("System.GetBool(debug.showloginfo)"),
+                          self.addon.getSetting("debug_log") == "true")
 
         # skinner (or user) enables the random fanart images by setting the randomfanartdelay skin string
         try:
@@ -130,6 +214,33 @@ class BackgroundsUpdater(threading.Thread):
 
         self.walls_delay = int(self.addon.getSetting("wallimages_delay"))
         self.wallimages.max_wallimages = int(self.addon.getSetting("max_wallimages"))
+        self.wallimages.wall_encoder = self.addon.getSetting("wall_encoder") or "jpeg"
+        try:
+            self.wallimages.wall_quality = min(max(int(self.addon.getSetting("wall_quality")), 1), 100)
+        except Exception:
+            self.wallimages.wall_quality = 85
+        self.wallimages.wall_progressive = self.addon.getSetting("wall_progressive") == "true"
+        self.wallimages.wall_optimize = self.addon.getSetting("wall_optimize") == "true"
+        self.wallimages.wall_effects = [effect for effect in WALL_EFFECTS
+                                        if self.addon.getSetting("wall_effect_%s" % effect.lower()) == "true"]
+        self.wallimages.wall_tint_color = parse_color(self.addon.getSetting("wall_tint_color"))
+        try:
+            self.wallimages.wall_disk_budget = int(self.addon.getSetting("wall_disk_budget")) * 1024 * 1024
+        except Exception:
+            self.wallimages.wall_disk_budget = 0
+        self.derivatives.enabled = self.addon.getSetting("enable_derivatives") == "true"
+        try:
+            self.derivatives.max_items = max(int(self.addon.getSetting("max_derivatives")), 1)
+        except Exception:
+            self.derivatives.max_items = 200
+        self.colors.enabled = self.addon.getSetting("enable_colors") == "true"
+        shared_store_path = self.addon.getSetting("shared_store_path")
+        if self.addon.getSetting("enable_shared_store") == "true" and shared_store_path:
+            shared_store_path = xbmcvfs.translatePath(shared_store_path)
+            if not self.shared_store or self.shared_store.path != shared_store_path:
+                self.shared_store = SharedStore(shared_store_path)
+        else:
+            self.shared_store = None
         self.pvr_bg_recordingsonly = self.addon.getSetting("pvr_bg_recordingsonly") == "true"
         self.enable_walls = xbmc.getCondVisibility("Skin.HasSetting(SkinHelper.EnableWallBackgrounds)")
         if self.addon.getSetting("enable_custom_images_path") == "true":
@@ -140,30 +251,91 @@ class BackgroundsUpdater(threading.Thread):
             # skinner can enable manual wall images generation so check for these settings
             # store in memory so wo do not have to query the skin settings too often
             if self.walls_delay:
-                for key in self.all_backgrounds_keys:
+                with self.lock:
+                    keys = list(self.all_backgrounds_keys.keys())
+                for key in keys:
                     limitrange = xbmc.getInfoLabel("Skin.String(%s.EnableWallImages)" % key)
                     if limitrange:
-                        self.wallimages.manual_walls[key] = int(limitrange)
+                        with self.wallimages.lock:
+                            self.wallimages.manual_walls[key] = int(limitrange)
         except Exception as exc:
             log_exception(__name__, exc)
 
+    def on_library_changed(self, method):
+        '''called by the kodimonitor when the library changed'''
+        with self.lock:
+            if self.negative_cache:
+                log_msg("%s - retrying all paths without images", xbmc.LOGDEBUG, method)
+                self.negative_cache = {}
+        # pools are cycled multiple times, make sure the new library content shows up after the current pass
+        self.pool_store.expire()
+
+    def on_pvr_changed(self, method):
+        '''called by the kodimonitor on pvr notifications, the cached pvr images are fetched again'''
+        log_msg("%s - refreshing the pvr backgrounds", xbmc.LOGDEBUG, method)
+        with self.lock:
+            self.pvr_cache = None
+        self.clear_negative_cache("pvr")
+        self.pool_store.expire("pvr")
+
+    def is_negative_cached(self, lib_path):
+        '''returns True if the path recently returned no images and should not be retried yet'''
+        with self.lock:
+            entry = self.negative_cache.get(lib_path)
+        return entry is not None and entry[1] > time.time()
+
+    def set_negative_cache(self, lib_path):
+        '''store a path which returned no images, the retry interval grows exponentially'''
+        with self.lock:
+            failures = self.negative_cache.get(lib_path, (0, 0))[0] + 1
+            retry_interval = min(NEGATIVE_CACHE_MIN * 2 ** (failures - 1), NEGATIVE_CACHE_MAX)
+            self.negative_cache[lib_path] = (failures, time.time() + retry_interval)
+
+    def clear_negative_cache(self, lib_path):
+        '''forget a path which returned no images before'''
+        with self.lock:
+            self.negative_cache.pop(lib_path, None)
+
+    def update_cond_background(self, check_file=False):
+        '''set the conditional background, only when the next transition is due or the schedule changed'''
+        if check_file or not self.cond_schedule:
+            schedule = get_cond_schedule()
+            if schedule is not self.cond_schedule:
+                self.cond_schedule = schedule
+                self.cond_transition = datetime.min
+        now = datetime.now()
+        if self.cond_transition and now >= self.cond_transition:
+            background, self.cond_transition = self.cond_schedule.get_background(now)
+            self.win.setProperty("SkinHelper.ConditionalBackground", background)
+
     def report_allbackgrounds(self):
         '''sets a list of all known backgrounds as winprop to be retrieved from skinshortcuts'''
-        if self.all_backgrounds_labels:
-            self.set_winprop("SkinHelper.AllBackgrounds", repr(self.all_backgrounds_labels))
+        with self.lock:
+            all_backgrounds_labels = list(self.all_backgrounds_labels)
+        if all_backgrounds_labels:
+            self.set_winprop("SkinHelper.AllBackgrounds", repr(all_backgrounds_labels))
 
     def set_winprop(self, key, value):
         '''sets a window property and writes it to our global list'''
         if self.exit:
             return
-        self.winprops[key] = value
+        with self.lock:
+            self.winprops[key] = value
         self.win.setProperty(key, value)
 
+    def clear_winprop(self, key):
+        '''clears a window property and removes it from our global list'''
+        with self.lock:
+            self.winprops.pop(key, None)
+        self.win.clearProperty(key)
+
     def winpropcache(self, setcache=False):
         '''sets/gets the current window props in a global cache to load them immediately at startup'''
         cachestr = "skinhelper.backgrounds.%s" % xbmc.getInfoLabel("System.ProfileName")
         if setcache:
-            self.cache.set(cachestr, self.winprops)
+            with self.lock:
+                winprops = dict(self.winprops)
+            self.cache.set(cachestr, winprops)
         else:
             cache = self.cache.get(cachestr)
             if cache:
@@ -222,6 +394,7 @@ class BackgroundsUpdater(threading.Thread):
             if len(result) == self.prefetch_images:
                 break
         random.shuffle(result)
+        log_sampled("get_images_from_vfspath", 20, "Fetched %s images from %s", xbmc.LOGDEBUG, len(result), lib_path)
         return result
 
     def get_pictures(self):
@@ -268,222 +441,348 @@ class BackgroundsUpdater(threading.Thread):
         '''set the window property for the background image'''
         if self.exit:
             return
-        image = None
-        if win_prop in self.all_backgrounds2:
-            # pick one random image from the small list using normal random function
-            if len(self.all_backgrounds2[win_prop]) > 0:
-                image = random.choice(self.all_backgrounds2[win_prop])
-        elif win_prop in self.all_backgrounds and len(self.all_backgrounds[win_prop]) > 0:
-            # list is already in memory and still contains images, grab the next item in line
-            image = self.all_backgrounds[win_prop][0]
-            # delete image from list when we've used it so we have truly randomized images with minimized possibility of duplicates
-            del self.all_backgrounds[win_prop][0]
+        if lib_path in ["pictures", "pvr"]:
+            source_key = lib_path
+            if lib_path == "pvr" and not self.is_pvr_cache_valid():
+                # the widgets were reloaded, refresh the pool with the new pvr images
+                self.pool_store.expire(source_key)
         else:
-            # no images in memory - load them from vfs
-            if lib_path == "pictures":
-                images = self.get_pictures()
-            elif lib_path == "pvr":
-                images = self.get_pvr_backgrounds()
-            else:
-                images = self.get_images_from_vfspath(lib_path)
-            # store images in memory
-            if (len(images) < self.prefetch_images):
-                # this path did not return enough images so we store it in a different list
-                # which will not be flushed
-                self.all_backgrounds2[win_prop] = images
-                if images:
-                    image = random.choice(images)
+            source_key = get_source_key(lib_path)
+        with self.lock:
+            self.all_backgrounds_keys[win_prop] = lib_path
+        # win_props resolving to the same source draw from the same pool, each with its own cursor
+        stale_pool = self.pool_store.get_pool(source_key)
+        image = self.pool_store.take(win_prop, source_key)
+        if not image and not self.is_negative_cached(source_key):
+            # no images in memory (or this win_prop went through the whole pool) - load them from vfs
+            # the images are taken from the pool one-by-one untill it's empty
+            # once empty a fresh pair of images will be retrieved for the path
+            # this way we have fully randomized images while there's no need
+            # to store a big pile of data in memory
+            pool, refilled = self.pool_store.refill(
+                source_key, stale_pool, lambda: self.get_source_images(lib_path), self.prefetch_images)
+            if not pool:
+                # empty or failing path, do not retry it on every rotation
+                self.set_negative_cache(source_key)
             else:
-                # normal approach: store the current set of images in a list
-                # images are taken from that list one-by-one untill it's empty
-                # once empty a fresh pair of images will be retrieved for the path
-                # this way we have fully randomized images while there's no need
-                # to store a big pile of data in memory
-                image = images[0]
-                del images[0]
-                self.all_backgrounds[win_prop] = images
-            # also store the key + label in a list for skinshortcuts - only if the path actually has images
-            if image:
-                self.save_background_label(win_prop, label)
+                if refilled:
+                    self.clear_negative_cache(source_key)
+                    # compute the colours of the images while they wait in the pool
+                    self.colors.queue_images(pool.images)
+                image = self.pool_store.take(win_prop, source_key)
+        # also store the key + label in a list for skinshortcuts - only if the path actually has images
+        if image:
+            self.save_background_label(win_prop, label)
+        # announce the upcoming image so the skin can preload it
+        next_image = None
+        if image:
+            next_image = self.pool_store.peek(win_prop)
+            # the screen-sized copy is prepared one rotation before the image is announced
+            after_next_image = self.pool_store.peek(win_prop, 2)
+            if after_next_image:
+                self.derivatives.prefetch(after_next_image.get("fanart"))
         # set the image
-        self.set_image(win_prop, image, fallback_image)
+        self.set_image(win_prop, image, fallback_image, next_image)
+
+    def get_source_images(self, lib_path):
+        '''fetch the images for a background source'''
+        if lib_path == "pictures":
+            return self.get_pictures()
+        if lib_path == "pvr":
+            return self.get_pvr_backgrounds()
+        if self.shared_store:
+            return self.get_shared_images(lib_path)
+        return self.get_images_from_vfspath(lib_path)
+
+    def get_shared_images(self, lib_path):
+        '''get the images for a library path from a recent pool snapshot of another client in the shared store,
+           if there is none the images are fetched from the library and published for the other clients'''
+        shared_store = self.shared_store
+        name = "pool-%s" % hashlib.md5(get_source_key(lib_path).encode("utf-8")).hexdigest()
+        try:
+            # the (large) manifest is only read if it changed since we've seen it,
+            # every snapshot is used only once so the next refill gets other images
+            manifest_time = shared_store.get_manifest_time(name)
+            with self.lock:
+                seen = self.shared_snapshots.get(name) == manifest_time
+                self.shared_snapshots[name] = manifest_time
+            if manifest_time and not seen:
+                manifest = shared_store.get_manifest(name, POOL_SNAPSHOT_MAX_AGE)
+                if manifest and manifest["client"] != shared_store.client_id and manifest["data"]:
+                    return manifest["data"]
+        except Exception as exc:
+            log_exception(__name__, exc)
+        images = self.get_images_from_vfspath(lib_path)
+        if images:
+            try:
+                shared_store.publish(name, data=images)
+                # our own snapshot is of no use for us
+                with self.lock:
+                    self.shared_snapshots[name] = shared_store.get_manifest_time(name)
+            except Exception as exc:
+                log_exception(__name__, exc)
+        return images
+
+    def get_winprop_images(self, win_prop):
+        '''get all images in memory for the given win_prop'''
+        return self.pool_store.get_images(win_prop)
 
     def set_global_background(self, win_prop, keys, fallback_image="", label=None):
         '''get random background from random other collection'''
-        image = None
-        # pick random category-key
-        random.shuffle(keys)
-        for key in keys:
-            if key in self.all_backgrounds2 and self.all_backgrounds2[key]:
-                # pick random image from this category
-                image = random.choice(self.all_backgrounds2[key])
-            elif key in self.all_backgrounds and self.all_backgrounds[key]:
-                # pick random image from this category
-                image = random.choice(self.all_backgrounds[key])
-            if image or self.exit:
-                break
+        # the image announced as next image in the previous rotation
+        with self.lock:
+            image = self.global_next.pop(win_prop, None)
+        if not image:
+            image = self.pick_global_image(win_prop, keys)
+        next_image = None
         # also store the win_prop + label in a list for skinshortcuts - only if the path actually has images
         if image:
             self.save_background_label(win_prop, label)
+            next_image = self.pick_global_image(win_prop, keys)
+            with self.lock:
+                self.global_next[win_prop] = next_image
         # set the image
-        self.set_image(win_prop, image, fallback_image)
+        self.set_image(win_prop, image, fallback_image, next_image)
         return image
 
-    
-    def set_image(self, win_prop, image, fallback_image):
+    def pick_global_image(self, win_prop, keys):
+        '''pick a random image from the pools of the member collections, weighted by their size'''
+        return self.pool_store.sample_aggregate(win_prop, list(keys))
+
+    def set_image(self, win_prop, image, fallback_image, next_image=None):
         ''' actually set the image window property'''
+        with self.lock:
+            announced = self.announced.pop(win_prop, None)
         if image:
             for key, value in image.items():  # image is actually a dict
                 if key == "fanart":
-                    self.set_winprop(win_prop, value)
+                    if announced and announced[0] == value:
+                        # publish the path the skin preloaded, even if the screen-sized copy is ready now
+                        self.set_winprop(win_prop, announced[1])
+                    else:
+                        # use the screen-sized copy of the image if we have one
+                        self.set_winprop(win_prop, self.derivatives.get(value) or value)
+                    if self.colors.enabled:
+                        colors = self.colors.get(value) or EMPTY_COLORS
+                        for color_key, color in colors.items():
+                            self.set_winprop("%s.Color.%s" % (win_prop, color_key), color)
                 else:  # set additional image properties
                     self.set_winprop("%s.%s" % (win_prop, key), value)
         elif fallback_image:
             # no image - use fallback_image
             self.set_winprop(win_prop, fallback_image)
+        # the upcoming image (one rotation ahead) for preloading in the skin
+        next_props = set()
+        if next_image:
+            for key, value in next_image.items():
+                if key == "fanart":
+                    # create the screen-sized copy if it was not prepared yet (it's used the next time then)
+                    self.derivatives.prefetch(value)
+                    path = self.derivatives.get(value) or value
+                    with self.lock:
+                        self.announced[win_prop] = (value, path)
+                    next_props.add("%s.Next" % win_prop)
+                    self.set_winprop("%s.Next" % win_prop, path)
+                else:
+                    next_props.add("%s.Next.%s" % (win_prop, key))
+                    self.set_winprop("%s.Next.%s" % (win_prop, key), value)
+        # the props of the previous next image which the new one does not have must not linger
+        with self.lock:
+            stale_props = [key for key in self.winprops if key not in next_props and
+                           (key == "%s.Next" % win_prop or key.startswith("%s.Next." % win_prop))]
+        for key in stale_props:
+            self.clear_winprop(key)
 
     def save_background_label(self, win_prop, label):
         ''' store background label in list, used for exachnge with other scripts'''
-        if not any(win_prop in item for item in self.all_backgrounds_labels):
-            if label and isinstance(label, int):
-                label = xbmc.getInfoLabel("$ADDON[%s %s]" % (ADDON_ID, label))
-            elif not label:
-                label = win_prop
-            self.all_backgrounds_labels.append((win_prop, label))
+        with self.lock:
+            if any(win_prop in item for item in self.all_backgrounds_labels):
+                return
+        if label and isinstance(label, int):
+            label = xbmc.getInfoLabel("$ADDON[%s %s]" % (ADDON_ID, label))
+        elif not label:
+            label = win_prop
+        with self.lock:
+            if not any(win_prop in item for item in self.all_backgrounds_labels):
+                self.all_backgrounds_labels.append((win_prop, label))
+
+    def is_pvr_cache_valid(self, widgetreload=None):
+        '''returns True if the cached pvr images are still current (same widgets reload token and settings)'''
+        if widgetreload is None:
+            widgetreload = self.win.getProperty("widgetreload2")
+        with self.lock:
+            return bool(self.pvr_cache) and self.pvr_cache[:2] == (widgetreload, self.pvr_bg_recordingsonly)
 
     def get_pvr_backgrounds(self):
-        '''get the images for pvr items by using the skinhelper widgets as source'''
-        images = []
+        '''get the images for pvr items by using the skinhelper widgets as source
+           the images are cached until the widgets reload token changes or a pvr notification is received'''
         widgetreload = self.win.getProperty("widgetreload2")
-        rec_images = self.get_images_from_vfspath(
-            "plugin://script.skin.helper.widgets/?mediatype=pvr"
-            "&action=recordings&limit=50&reload=%s" % widgetreload)
-        if rec_images:  # result can be None
-            images = rec_images
+        with self.lock:
+            if self.is_pvr_cache_valid(widgetreload):
+                return self.pvr_cache[2]
+        paths = ["plugin://script.skin.helper.widgets/?mediatype=pvr"
+                 "&action=recordings&limit=50&reload=%s" % widgetreload]
         if not self.pvr_bg_recordingsonly:
-            tv_images = self.get_images_from_vfspath(
-                "plugin://script.skin.helper.widgets/?mediatype=pvr"
-                "&channelgroup=1&action=channels&limit=25&reload=%s" % widgetreload)
-            if tv_images:  # result can be None
-                images += tv_images
+            paths.append("plugin://script.skin.helper.widgets/?mediatype=pvr"
+                         "&channelgroup=1&action=channels&limit=25&reload=%s" % widgetreload)
+        # the plugin calls are slow on most pvr backends, run them concurrently
+        results = [None] * len(paths)
+
+        def fetch(index, path):
+            results[index] = self.get_images_from_vfspath(path)
+        threads = [threading.Thread(target=fetch, args=(index, path)) for index, path in enumerate(paths)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        images = []
+        for result in results:
+            if result:  # result can be None
+                images += result
+        if images:
+            with self.lock:
+                self.pvr_cache = (widgetreload, self.pvr_bg_recordingsonly, images)
         return images
 
     def update_backgrounds(self):
         '''update all our provided backgrounds'''
 
         # conditional background
-        self.win.setProperty("SkinHelper.ConditionalBackground", get_cond_background())
+        self.update_cond_background()
+
+        # backgrounds which are not used by the skin are only rotated lazily
+        self.demand.next_tick()
+
+        for win_prop, lib_path, label in self.get_backgrounds():
+            if self.demand.is_due(win_prop):
+                self.set_background(win_prop, lib_path, label=label)
+
+        for win_prop, keys, label in self.get_global_backgrounds():
+            if self.demand.is_due(win_prop):
+                self.set_global_background(win_prop, keys, label=label)
+
+    def get_backgrounds(self):
+        '''returns all backgrounds to rotate as list of (win_prop, lib_path, label) tuples'''
+        backgrounds = []
 
         # movies backgrounds
         if xbmc.getCondVisibility("Library.HasContent(movies)"):
             # random/all movies
-            self.set_background("SkinHelper.AllMoviesBackground", "videodb://movies/titles/", label=32010)
+            backgrounds.append(("SkinHelper.AllMoviesBackground", "videodb://movies/titles/", 32010))
             # in progress movies
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.InProgressMoviesBackground",
                 "videodb://movies/titles/?xsp=%s" %
                 urlencode(
                     '{"limit":50,"order":{"direction":"ascending","method":"random"},'
                     '"rules":{"and":[{"field":"inprogress","operator":"true","value":[]}]},"type":"movies"}'),
-                label=32012)
+                32012))
             # recent movies
-            self.set_background("SkinHelper.RecentMoviesBackground", "videodb://recentlyaddedmovies/", label=32011)
+            backgrounds.append(("SkinHelper.RecentMoviesBackground", "videodb://recentlyaddedmovies/", 32011))
             # unwatched movies
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.UnwatchedMoviesBackground",
                 "videodb://movies/titles/?xsp=%s" %
                 urlencode(
                     '{"limit":50,"order":{"direction":"ascending","method":"random"},'
-                    '"rules":{"and":[{"field":"playcount","operator":"is","value":0}]},"type":"movies"}'), label=32013)
+                    '"rules":{"and":[{"field":"playcount","operator":"is","value":0}]},"type":"movies"}'), 32013))
 
         # tvshows backgrounds
         if xbmc.getCondVisibility("Library.HasContent(tvshows)"):
             # random/all tvshows
-            self.set_background("SkinHelper.AllTvShowsBackground", "videodb://tvshows/titles/", label=32014)
+            backgrounds.append(("SkinHelper.AllTvShowsBackground", "videodb://tvshows/titles/", 32014))
             # in progress tv shows
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.InProgressShowsBackground",
                 "videodb://tvshows/titles/?xsp=%s" %
                 urlencode(
                     '{"limit":50,"order":{"direction":"ascending","method":"random"},'
                     '"rules":{"and":[{"field":"inprogress","operator":"true","value":[]}]},"type":"tvshows"}'),
-                label=32016)
+                32016))
             # recent episodes
-            self.set_background("SkinHelper.RecentEpisodesBackground", "videodb://recentlyaddedepisodes/", label=32015)
+            backgrounds.append(("SkinHelper.RecentEpisodesBackground", "videodb://recentlyaddedepisodes/", 32015))
 
         # all musicvideos
         if xbmc.getCondVisibility("Library.HasContent(musicvideos)"):
-            self.set_background("SkinHelper.AllMusicVideosBackground", "videodb://musicvideos/titles", label=32018)
+            backgrounds.append(("SkinHelper.AllMusicVideosBackground", "videodb://musicvideos/titles", 32018))
 
         # all music
         if xbmc.getCondVisibility("Library.HasContent(music)"):
             # music artists
-            self.set_background("SkinHelper.AllMusicBackground", "musicdb://artists/", label=32019)
+            backgrounds.append(("SkinHelper.AllMusicBackground", "musicdb://artists/", 32019))
             # recent albums
-            self.set_background(
-                "SkinHelper.RecentMusicBackground", "musicdb://recentlyaddedalbums/", label=32023)
+            backgrounds.append((
+                "SkinHelper.RecentMusicBackground", "musicdb://recentlyaddedalbums/", 32023))
             # random songs
-            self.set_background(
-                "SkinHelper.AllMusicSongsBackground", "musicdb://songs/", label=32022)
+            backgrounds.append((
+                "SkinHelper.AllMusicSongsBackground", "musicdb://songs/", 32022))
 
         # tmdb backgrounds (extendedinfo)
         if xbmc.getCondVisibility("System.HasAddon(script.extendedinfo)"):
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.TopRatedMovies",
                 "plugin://script.extendedinfo/?info=topratedmovies",
-                label=32020)
-            self.set_background(
+                32020))
+            backgrounds.append((
                 "SkinHelper.TopRatedShows",
                 "plugin://script.extendedinfo/?info=topratedtvshows",
-                label=32021)
+                32021))
 
         # tmdb backgrounds (embuary.info)
         if xbmc.getCondVisibility("System.HasAddon(script.embuary.info)"):
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.TrendingMovies",
                 "plugin://script.embuary.info/movie/trending",
-                label=32033)
-            self.set_background(
+                32033))
+            backgrounds.append((
                 "SkinHelper.TrendingShows",
                 "plugin://script.embuary.info/tv/trending",
-                label=32034)
+                32034))
 
         # tmdb backgrounds (themoviedb.helper)
         if xbmc.getCondVisibility("System.HasAddon(plugin.video.themoviedb.helper)"):
-            self.set_background(
+            backgrounds.append((
                 "SkinHelper.PopularMovies",
                 "plugin://plugin.video.themoviedb.helper?info=popular&amp;type=movie",
-                label=32035)
-            self.set_background(
+                32035))
+            backgrounds.append((
                 "SkinHelper.PopularShows",
                 "plugin://plugin.video.themoviedb.helper?info=popular&amp;type=tv",
-                label=32036)
+                32036))
 
         # pictures background
-        self.set_background("SkinHelper.PicturesBackground", "pictures", label=32017)
+        backgrounds.append(("SkinHelper.PicturesBackground", "pictures", 32017))
 
         # pvr background
         if xbmc.getCondVisibility("PVR.HasTvChannels"):
-            self.set_background("SkinHelper.PvrBackground", "pvr", label=32024)
+            backgrounds.append(("SkinHelper.PvrBackground", "pvr", 32024))
 
         # smartshortcuts backgrounds
         for node in self.smartshortcuts.get_smartshortcuts_nodes():
-            self.set_background(node[0], node[1], label=node[2])
-
-        # global backgrounds
-        self.set_global_background("SkinHelper.GlobalFanartBackground",
-                            ["SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground",
-                             "SkinHelper.AllMusicVideosBackground", "SkinHelper.AllMusicBackground"],
-                            label=32009)
-        self.set_global_background("SkinHelper.AllVideosBackground",
-                            ["SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground",
-                             "SkinHelper.AllMusicVideosBackground"], label=32025)
-        self.set_global_background(
+            backgrounds.append((node[0], node[1], node[2]))
+
+        return backgrounds
+
+    def get_global_backgrounds(self):
+        '''returns all global backgrounds as list of (win_prop, member win_props, label) tuples
+           global backgrounds pick their images from the member backgrounds'''
+        global_backgrounds = []
+        global_backgrounds.append((
+            "SkinHelper.GlobalFanartBackground",
+            ["SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground",
+             "SkinHelper.AllMusicVideosBackground", "SkinHelper.AllMusicBackground"], 32009))
+        global_backgrounds.append((
+            "SkinHelper.AllVideosBackground",
+            ["SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground",
+             "SkinHelper.AllMusicVideosBackground"], 32025))
+        global_backgrounds.append((
             "SkinHelper.AllVideosBackground2", [
-                "SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground"], label=32026)
-        self.set_global_background(
+                "SkinHelper.AllMoviesBackground", "SkinHelper.AllTvShowsBackground"], 32026))
+        global_backgrounds.append((
             "SkinHelper.RecentVideosBackground",
-            ["SkinHelper.RecentMoviesBackground", "SkinHelper.RecentEpisodesBackground"], label=32027)
-        self.set_global_background(
+            ["SkinHelper.RecentMoviesBackground", "SkinHelper.RecentEpisodesBackground"], 32027))
+        global_backgrounds.append((
             "SkinHelper.InProgressVideosBackground",
-            ["SkinHelper.InProgressMoviesBackground", "SkinHelper.InProgressShowsBackground"], label=32028)
+            ["SkinHelper.InProgressMoviesBackground", "SkinHelper.InProgressShowsBackground"], 32028))
+        return global_backgrounds
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Colour index for the background images.
+    The dominant and average colour of the images are computed in a low priority worker
+    while the images wait in the pool and are stored in a persistent index by image url,
+    so the colours are published together with the image without decoding it again.
+'''
+
+from .utils import log_msg
+from .jobworker import JobWorker
+from .wallimages import SUPPORTS_PIL
+from collections import OrderedDict
+from datetime import timedelta
+import xbmc
+import xbmcvfs
+import io
+import threading
+
+if SUPPORTS_PIL:
+    from PIL import Image
+
+try:
+    import numpy
+    SUPPORTS_NUMPY = True
+except ImportError:
+    SUPPORTS_NUMPY = False
+
+COLORS_CACHE = "skinhelper.backgrounds.colors"
+COLORS_MAX_ITEMS = 5000  # max number of images in the persistent index
+COLORS_SAMPLE_SIZE = (64, 64)  # the colours are computed on a thumbnail of this size
+PALETTE_SIZE = 5
+EMPTY_COLORS = {"Dominant": "", "Average": "", "Text": ""}
+
+
+class ColorIndex(object):
+    '''persistent index of the dominant and average colour of the background images'''
+    enabled = False
+
+    def __init__(self, bgupdater):
+        self.bgupdater = bgupdater
+        self.worker = JobWorker("ColorWorker")
+        self.lock = threading.Lock()
+        self.index = None  # image url --> colours, ordered from least to most recently used
+        self.dirty = False
+
+    def stop(self):
+        '''stop the worker and store the index'''
+        self.worker.stop()
+        self.save_index()
+
+    def load_index(self):
+        '''load the index from the cache (once)'''
+        if self.index is None:
+            self.index = OrderedDict(self.bgupdater.cache.get(COLORS_CACHE) or {})
+
+    def save_index(self):
+        '''store the index in the cache if it changed'''
+        with self.lock:
+            if not self.dirty or self.index is None:
+                return
+            self.dirty = False
+            index = dict(self.index)
+        self.bgupdater.cache.set(COLORS_CACHE, index, expiration=timedelta(days=90))
+
+    def get(self, url):
+        '''returns the colours of the image, None if not (yet) computed'''
+        if not self.enabled or not SUPPORTS_PIL or not url:
+            return None
+        with self.lock:
+            self.load_index()
+            return self.index.get(url)
+
+    def queue_images(self, images):
+        '''queue the colour extraction for the (fanart of the) images in a pool'''
+        if not self.enabled or not SUPPORTS_PIL:
+            return
+        with self.lock:
+            self.load_index()
+            urls = [image["fanart"] for image in images if image.get("fanart") and image["fanart"] not in self.index]
+        if not urls:
+            return
+        if not self.worker.ident:
+            self.worker.start()
+        for url in urls:
+            self.worker.add_job("colors:%s" % url, self.compute, (url,), priority=60)
+
+    def compute(self, job, url):
+        '''compute the colours of a single image'''
+        # the screen-sized copy is local and a lot smaller, use it when available
+        file = xbmcvfs.File(self.bgupdater.derivatives.get(url) or url)
+        try:
+            img = Image.open(io.BytesIO(bytearray(file.readBytes())))
+            if not job.checkpoint():
+                return
+            # let the jpeg decoder scale down while decoding
+            img.draft("RGB", COLORS_SAMPLE_SIZE)
+            img = img.convert("RGB")
+            img.thumbnail(COLORS_SAMPLE_SIZE)
+            colors = get_colors(img)
+            del img
+        except Exception:
+            log_msg("Colors for %s could not be computed" % url, xbmc.LOGDEBUG)
+            return
+        finally:
+            file.close()
+        with self.lock:
+            self.index[url] = colors
+            while len(self.index) > COLORS_MAX_ITEMS:
+                self.index.popitem(last=False)
+            self.dirty = True
+        if not self.worker.has_pending():
+            # store the index once all queued images are done
+            self.save_index()
+
+
+def get_colors(img):
+    '''returns the dominant, average and text colour of a (small) RGB image as kodi colour strings'''
+    if SUPPORTS_NUMPY:
+        average = tuple(int(value) for value in numpy.asarray(img, dtype=numpy.float32).reshape(-1, 3).mean(axis=0))
+    else:
+        pixels = list(img.getdata())
+        average = tuple(sum(pixel[i] for pixel in pixels) // len(pixels) for i in range(3))
+    # the dominant colour is the most used colour of the reduced palette
+    quantized = img.quantize(colors=PALETTE_SIZE)
+    palette = quantized.getpalette()
+    index = max(quantized.getcolors(), key=lambda item: item[0])[1]
+    dominant = tuple(palette[index * 3:index * 3 + 3])
+    # perceived brightness of the average colour decides between white and black text
+    luminance = 0.299 * average[0] + 0.587 * average[1] + 0.114 * average[2]
+    return {
+        "Dominant": to_kodi_color(dominant),
+        "Average": to_kodi_color(average),
+        "Text": "FF000000" if luminance > 160 else "FFFFFFFF"
+    }
+
+
+def to_kodi_color(color):
+    '''RGB tuple to kodi AARRGGBB colour string'''
+    return "FF%02X%02X%02X" % tuple(color)
@@ -13,7 +13,10 @@ import xbmc
 import xbmcgui
 import xbmcvfs
 import xbmcaddon
-from datetime import datetime
+from datetime import datetime, timedelta
+import bisect
+import json
+import ast
 import time
 
 CACHE_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/"
@@ -92,7 +95,7 @@ class ConditionalBackgrounds(xbmcgui.WindowXMLDialog):
             xbmcvfs.mkdir(CACHE_PATH)
         # write backgrounds to file
         text_file = xbmcvfs.File(CACHE_FILE, "w")
-        text_file.write(repr(self.all_backgrounds))
+        text_file.write(json.dumps(self.all_backgrounds))
         text_file.close()
         self.close()
 
@@ -187,19 +190,6 @@ class ConditionalBackgrounds(xbmcgui.WindowXMLDialog):
 # GLOBAL HELPERS - ALSO ACCESSED BY BACKGROUNDS UPDATER SERVICE
 
 
-def get_cond_background():
-    '''get the current active conditional background (if any) - called by the background service'''
-    background = ""
-    all_cond_backgrounds = get_cond_backgrounds()
-    if all_cond_backgrounds:
-        date_today = datetime.now().strftime(DATE_FORMAT)
-        for item in all_cond_backgrounds:
-            if time_in_range(item["startdate"], item["enddate"], date_today):
-                background = item["background"]
-                break
-    return background
-
-
 def get_cond_backgrounds():
     '''read all backgrounds that are setup'''
     all_backgrounds = []
@@ -207,7 +197,11 @@ def get_cond_backgrounds():
         text_file = xbmcvfs.File(CACHE_FILE)
         try:
             text = text_file.read()
-            all_backgrounds = eval(text)
+            try:
+                all_backgrounds = json.loads(text)
+            except ValueError:
+                # file written by an older version (python repr)
+                all_backgrounds = ast.literal_eval(text)
         except Exception as exc:
             log_exception(__name__, exc)
         finally:
@@ -215,6 +209,66 @@ def get_cond_backgrounds():
     return all_backgrounds
 
 
+_SCHEDULE_CACHE = {"checksum": None, "schedule": None}
+
+
+def get_cond_schedule():
+    '''get the compiled schedule of the conditional backgrounds, only (re)read if the file changed'''
+    checksum = ""
+    if xbmcvfs.exists(CACHE_FILE):
+        stat = xbmcvfs.Stat(CACHE_FILE)
+        checksum = "%s-%s" % (stat.st_mtime(), stat.st_size())
+    if _SCHEDULE_CACHE["schedule"] is None or _SCHEDULE_CACHE["checksum"] != checksum:
+        _SCHEDULE_CACHE["schedule"] = ConditionalSchedule(get_cond_backgrounds())
+        _SCHEDULE_CACHE["checksum"] = checksum
+    return _SCHEDULE_CACHE["schedule"]
+
+
+class ConditionalSchedule(object):
+    '''sorted interval index of the conditional backgrounds
+       the timeline is split at every start and end date, for each segment the active background is precomputed
+       so the lookup of the active background and the next transition is a binary search'''
+
+    def __init__(self, all_backgrounds):
+        ranges = []
+        for item in all_backgrounds:
+            try:
+                startdate = datetime.strptime(item["startdate"], DATE_FORMAT)
+                enddate = datetime.strptime(item["enddate"], DATE_FORMAT)
+                ranges.append((startdate, enddate, item["background"]))
+            except Exception:
+                log_msg("Conditional background %s is invalid - skipped" % repr(item))
+        # the segment boundaries, segment i starts at boundaries[i-1] and ends at boundaries[i]
+        # a range ends at the end of its end date, so the boundary is the day after
+        self.boundaries = sorted(set([item[0] for item in ranges] + [item[1] + timedelta(days=1) for item in ranges]))
+        self.backgrounds = []
+        if not self.boundaries:
+            self.backgrounds.append("")
+        for index in range(len(self.boundaries) + 1 if self.boundaries else 0):
+            if index < len(self.boundaries):
+                # any moment within the segment
+                moment = self.boundaries[index] - timedelta(days=1)
+            else:
+                moment = self.boundaries[-1]
+            background = ""
+            for startdate, enddate, item_background in ranges:
+                # the moment is the start of a day, the same check as the dialog does on the date strings
+                if time_in_range(startdate, enddate, moment):
+                    # the first matching entry wins
+                    background = item_background
+                    break
+            self.backgrounds.append(background)
+
+    def get_background(self, date_time):
+        '''returns a tuple of the active background for the given datetime and the datetime of the next transition
+           the next transition is None if the background will not change anymore'''
+        index = bisect.bisect_right(self.boundaries, date_time)
+        next_transition = None
+        if index < len(self.boundaries):
+            next_transition = self.boundaries[index]
+        return self.backgrounds[index], next_transition
+
+
 def time_in_range(start, end, date_time):
     '''determine if the given time is within the range'''
     if start <= end:
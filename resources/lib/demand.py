@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Demand registry: which background properties are actually used by the skin.
+    Skins opt in by declaring the backgrounds they use in the SkinHelper.Backgrounds.Demand skin string
+    or window property, the backgrounds referenced in the skinshortcuts menus are added to the declared ones.
+    Backgrounds in demand rotate on every tick, the others are only refreshed lazily.
+    If the skin does not declare anything, all backgrounds are in demand.
+'''
+
+from .utils import log_msg
+import xbmc
+import xbmcvfs
+import re
+
+DEMAND_PROPERTY = "SkinHelper.Backgrounds.Demand"
+SKINSHORTCUTS_INCLUDES = "script-skinshortcuts-includes.xml"
+LAZY_ROTATION = 10  # backgrounds which are not in demand rotate every n-th tick
+
+
+class DemandRegistry(object):
+    '''keeps track of the background properties in demand'''
+
+    def __init__(self):
+        self.demanded = None  # all win_props in demand, None if everything is in demand
+        self.declared = set()
+        self.includes_checksum = None
+        self.includes_data = ""
+        self.tick = -1
+
+    def update(self, win_props, global_backgrounds, always_demanded=()):
+        '''read the declaration of the skin and look up the known win_props in the skinshortcuts menus
+           win_props: all backgrounds we provide (including the smart shortcuts nodes)
+           the members of a global background in demand and the always_demanded win_props are in demand too'''
+        declared = xbmc.getInfoLabel("Skin.String(%s)" % DEMAND_PROPERTY) or \
+            xbmc.getInfoLabel("Window(Home).Property(%s)" % DEMAND_PROPERTY)
+        declared = set(item.strip() for item in re.split(r"[,|]", declared) if item.strip())
+        self.declared = declared
+        self.read_skinshortcuts()
+        if not declared:
+            # the skin did not opt in, everything rotates on every tick
+            self.demanded = None
+            return
+        demanded = declared | set(always_demanded)
+        demanded.update(win_prop for win_prop in win_props if self.is_referenced(win_prop))
+        for win_prop, keys, _ in global_backgrounds:
+            if win_prop in demanded:
+                demanded.update(keys)
+        if demanded != self.demanded:
+            log_msg("DemandRegistry - backgrounds in demand: %s", xbmc.LOGDEBUG, sorted(demanded))
+        self.demanded = demanded
+
+    def read_skinshortcuts(self):
+        '''read the includes generated by skinshortcuts (only if changed)'''
+        includes_file = get_includes_file()
+        if not includes_file:
+            self.includes_data = ""
+            self.includes_checksum = None
+            return
+        stat = xbmcvfs.Stat(includes_file)
+        checksum = "%s-%s" % (stat.st_mtime(), stat.st_size())
+        if checksum == self.includes_checksum:
+            return
+        self.includes_checksum = checksum
+        file = xbmcvfs.File(includes_file)
+        try:
+            self.includes_data = file.read()
+        finally:
+            file.close()
+
+    def is_referenced(self, win_prop):
+        '''returns True if the win_prop (or one of its sub properties like .poster) is used in the menus'''
+        if not self.includes_data:
+            return False
+        # SkinHelper.AllVideosBackground must not match SkinHelper.AllVideosBackground2
+        return re.search(r"%s(?![A-Za-z0-9_])" % re.escape(win_prop), self.includes_data) is not None
+
+    def is_in_use(self, win_prop):
+        '''returns True if the skin uses the win_prop: declared in demand or referenced in the menus
+           like is_due, everything we publish is in use if the skin did not declare anything'''
+        if not self.declared:
+            return True
+        return win_prop in self.declared or self.is_referenced(win_prop)
+
+    def next_tick(self):
+        '''start a new rotation'''
+        self.tick += 1
+
+    def is_due(self, win_prop):
+        '''returns True if the win_prop should rotate on the current tick'''
+        if self.demanded is None or win_prop in self.demanded:
+            return True
+        # the first rotation sets all backgrounds so they're known (and have an image)
+        return self.tick % LAZY_ROTATION == 0
+
+
+def get_includes_file():
+    '''returns the path to the skinshortcuts includes of the current skin, None if not found'''
+    file = xbmcvfs.File("special://skin/addon.xml")
+    try:
+        data = file.read()
+    finally:
+        file.close()
+    for folder in re.findall(r'folder="([^"]+)"', data) or ["xml"]:
+        includes_file = "special://skin/%s/%s" % (folder, SKINSHORTCUTS_INCLUDES)
+        if xbmcvfs.exists(includes_file):
+            return includes_file
+    return None
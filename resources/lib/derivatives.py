@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Screen-sized derivative cache for the rotating backgrounds.
+    Upcoming pool images are downscaled to the display resolution in a low priority worker
+    and stored in the addon_data folder, the service publishes the cached local copy instead
+    of the (often 4K and remote) original image.
+'''
+
+from .utils import log_msg
+from .jobworker import JobWorker
+from .wallimages import SUPPORTS_PIL
+from collections import OrderedDict
+import xbmc
+import xbmcvfs
+import hashlib
+import io
+import threading
+
+if SUPPORTS_PIL:
+    from PIL import Image
+
+DERIVATIVES_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/derivatives/"
+
+
+class DerivativeCache(object):
+    '''LRU-bounded cache of screen-sized copies of the background images'''
+    enabled = False
+    max_items = 200
+
+    def __init__(self):
+        self.worker = JobWorker("DerivativeWorker")
+        self.lock = threading.Lock()
+        self.index = None  # hash of the image url --> None, ordered from least to most recently used
+
+    def stop(self):
+        '''stop the worker'''
+        self.worker.stop()
+
+    def load_index(self):
+        '''load the existing derivatives from disk (once)'''
+        if self.index is None:
+            self.index = OrderedDict()
+            if xbmcvfs.exists(DERIVATIVES_PATH):
+                for file in xbmcvfs.listdir(DERIVATIVES_PATH)[1]:
+                    self.index[file.split(".")[0]] = None
+            else:
+                xbmcvfs.mkdirs(DERIVATIVES_PATH)
+
+    def get(self, url):
+        '''returns the path of the cached derivative of the image, None if not (yet) available'''
+        if not self.enabled or not SUPPORTS_PIL or not url:
+            return None
+        url_hash = get_hash(url)
+        with self.lock:
+            self.load_index()
+            if url_hash not in self.index:
+                return None
+            # mark as most recently used
+            del self.index[url_hash]
+            self.index[url_hash] = None
+        return DERIVATIVES_PATH + url_hash + ".jpg"
+
+    def prefetch(self, url):
+        '''queue the creation of the derivative of an upcoming image'''
+        if not self.enabled or not SUPPORTS_PIL or not url or url.startswith(DERIVATIVES_PATH):
+            return
+        url_hash = get_hash(url)
+        with self.lock:
+            self.load_index()
+            if url_hash in self.index:
+                return
+        if not self.worker.ident:
+            self.worker.start()
+        self.worker.add_job("derivative:%s" % url_hash, self.create, (url, url_hash), priority=50)
+
+    def create(self, job, url, url_hash):
+        '''create the screen-sized derivative of the image'''
+        try:
+            screen_size = (int(xbmc.getInfoLabel("System.ScreenWidth")),
+                           int(xbmc.getInfoLabel("System.ScreenHeight")))
+        except ValueError:
+            screen_size = (1920, 1080)
+        file = xbmcvfs.File(url)
+        try:
+            img = Image.open(io.BytesIO(bytearray(file.readBytes())))
+            if not job.checkpoint():
+                return
+            img = img.convert("RGB")
+            # only downscale, never enlarge
+            img.thumbnail(screen_size, Image.LANCZOS)
+            img.save(xbmcvfs.translatePath(DERIVATIVES_PATH + url_hash + ".jpg"), "JPEG", quality=90)
+            del img
+        except Exception:
+            log_msg("Derivative for %s could not be created" % url, xbmc.LOGDEBUG)
+            return
+        finally:
+            file.close()
+        with self.lock:
+            self.index[url_hash] = None
+            # evict the least recently used derivatives
+            while len(self.index) > self.max_items:
+                old_hash = self.index.popitem(last=False)[0]
+                xbmcvfs.delete(DERIVATIVES_PATH + old_hash + ".jpg")
+
+
+def get_hash(url):
+    '''returns the hash of an image url, used as filename of the derivative'''
+    if not isinstance(url, bytes):
+        url = url.encode("utf-8")
+    return hashlib.md5(url).hexdigest()
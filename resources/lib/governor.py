@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Resource governor: derives a load level from the playback state, the user's idle time,
+    the screensaver, library scans and the CPU time of the (Kodi) process.
+    The service scales the rotation cadence, the prefetch concurrency and the wall builds
+    to the load level so it does not compete with playback on weak hardware.
+'''
+
+from .utils import log_msg
+import xbmc
+import os
+import time
+
+# load levels
+LEVEL_IDLE = 0  # nobody is using kodi: the screensaver is active or no input for a while
+LEVEL_NORMAL = 1
+LEVEL_BUSY = 2  # music playback, library scan or high cpu load
+LEVEL_PLAYBACK = 3  # video playback: no heavy work at all
+
+LEVEL_NAMES = ["idle", "normal", "busy", "playback"]
+
+IDLE_TIME = 30  # seconds without user input before we consider kodi idle
+CPU_BUSY = 0.6  # fraction of the total cpu capacity used by the kodi process considered busy
+CPU_SAMPLE_INTERVAL = 5  # minimum interval in seconds between two cpu samples
+
+# per level: multiplier for the rotation interval (0 is no rotation at all),
+# number of concurrent prefetches and the delay in ms between the source images of a wall build
+ROTATION_FACTOR = {LEVEL_IDLE: 1, LEVEL_NORMAL: 1, LEVEL_BUSY: 2, LEVEL_PLAYBACK: 1}
+PREFETCH_CONCURRENCY = {LEVEL_IDLE: 4, LEVEL_NORMAL: 2, LEVEL_BUSY: 1, LEVEL_PLAYBACK: 1}
+WALL_THROTTLE = {LEVEL_IDLE: 0, LEVEL_NORMAL: 100, LEVEL_BUSY: 500, LEVEL_PLAYBACK: 500}
+
+
+class ResourceGovernor(object):
+    '''tracks the system state and derives the load level'''
+
+    def __init__(self):
+        self.level = LEVEL_NORMAL
+        self.screensaver = False
+        self.cpu_load = 0.0
+        self.cpu_sample = None  # (time, process cpu time) of the last cpu sample
+        try:
+            self.cpu_count = os.cpu_count() or 1
+        except AttributeError:
+            # python 2
+            import multiprocessing
+            self.cpu_count = multiprocessing.cpu_count()
+
+    def update(self):
+        '''sample the system state, returns the (new) load level'''
+        self.screensaver = xbmc.getCondVisibility("System.ScreenSaverActive")
+        self.sample_cpu()
+        if xbmc.getCondVisibility("Player.HasVideo"):
+            level = LEVEL_PLAYBACK
+        elif (xbmc.getCondVisibility("Player.HasAudio") or xbmc.getCondVisibility("Library.IsScanning") or
+              self.cpu_load > CPU_BUSY):
+            level = LEVEL_BUSY
+        elif self.screensaver or xbmc.getGlobalIdleTime() >= IDLE_TIME:
+            level = LEVEL_IDLE
+        else:
+            level = LEVEL_NORMAL
+        if level != self.level:
+            log_msg("ResourceGovernor - load level changed to %s (cpu: %.2f)",
+                    xbmc.LOGDEBUG, LEVEL_NAMES[level], self.cpu_load)
+            self.level = level
+        return level
+
+    def sample_cpu(self):
+        '''calculate the cpu load of the kodi process since the previous sample'''
+        now = time.time()
+        if self.cpu_sample and now - self.cpu_sample[0] < CPU_SAMPLE_INTERVAL:
+            return
+        times = os.times()
+        cpu_time = times[0] + times[1]
+        if self.cpu_sample and now > self.cpu_sample[0]:
+            self.cpu_load = (cpu_time - self.cpu_sample[1]) / ((now - self.cpu_sample[0]) * self.cpu_count)
+        self.cpu_sample = (now, cpu_time)
+
+    def rotation_delay(self, delay):
+        '''returns the rotation interval for the current load level, 0 if the backgrounds should not rotate'''
+        if self.screensaver:
+            # nobody is looking at the backgrounds
+            return 0
+        return delay * ROTATION_FACTOR[self.level]
+
+    def prefetch_concurrency(self):
+        '''returns the max number of backgrounds which may be fetched at the same time'''
+        return PREFETCH_CONCURRENCY[self.level]
+
+    def allow_heavy_work(self):
+        '''returns True if heavy work (like building new walls) may be started'''
+        return self.level == LEVEL_IDLE
+
+    def allow_background_work(self):
+        '''returns True if the low priority workers (walls, derivatives, colours) may run'''
+        return self.level < LEVEL_BUSY
+
+    def throttle(self):
+        '''short pause between the steps of heavy work, depends on the load level'''
+        delay = WALL_THROTTLE[self.level]
+        if delay:
+            xbmc.sleep(delay)
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Long-lived worker thread which processes a priority queue of jobs.
+    Used to run the heavy (wall) work outside the main service loop.
+    Jobs are identified by a key: a job which is already queued or running
+    is not added again. Running jobs can be cancelled or paused, jobs must
+    call job.checkpoint() regularly to honour this.
+'''
+
+from .utils import log_msg, log_exception
+import threading
+import heapq
+import xbmc
+
+
+class Job(object):
+    '''A single unit of work for the JobWorker'''
+
+    def __init__(self, worker, key, func, args, priority):
+        self.worker = worker
+        self.key = key
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.cancelled = False
+        self.progress = 0
+        self.step = 0
+        self.total_steps = 1
+
+    def cancel(self):
+        '''request cancellation of this job'''
+        self.cancelled = True
+
+    def checkpoint(self):
+        '''called by the job function between steps, blocks while the worker is paused
+           returns False if the job should stop'''
+        while not self.worker.resume_event.is_set():
+            if self.cancelled or self.worker.exit:
+                break
+            self.worker.resume_event.wait(1)
+        return not (self.cancelled or self.worker.exit)
+
+    def set_steps(self, total_steps):
+        '''set the number of steps of this job, used to calculate the progress'''
+        self.step = 0
+        self.total_steps = max(total_steps, 1)
+
+    def next_step(self):
+        '''mark the current step as done'''
+        self.step += 1
+        self.set_progress(100.0 * self.step / self.total_steps)
+
+    def set_step_progress(self, fraction):
+        '''report the progress (0.0 - 1.0) within the current step'''
+        self.set_progress(100.0 * (self.step + fraction) / self.total_steps)
+
+    def set_progress(self, progress):
+        '''report the progress (percentage) of this job'''
+        progress = int(progress)
+        if progress != self.progress:
+            self.progress = progress
+            log_msg("Job %s - progress: %s%%", xbmc.LOGDEBUG, self.key, progress)
+            if self.worker.progress_callback:
+                self.worker.progress_callback(self.key, progress)
+
+
+class JobWorker(threading.Thread):
+    '''Worker thread processing jobs in order of priority (lowest value first)'''
+
+    def __init__(self, name="JobWorker", progress_callback=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.exit = False
+        self.progress_callback = progress_callback
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.current_job = None
+        self._condition = threading.Condition()
+        self._queue = []
+        self._pending = {}
+        self._counter = 0
+
+    def add_job(self, key, func, args=(), priority=10):
+        '''queue a job, duplicate jobs collapse into the queued or running one
+           the function is called with the job as first argument'''
+        with self._condition:
+            if self.exit:
+                return None
+            job = self._pending.get(key)
+            if job:
+                if priority < job.priority:
+                    # raise the priority of the queued job, the old queue entry is skipped later
+                    job.priority = priority
+                    self._push(job)
+                return job
+            if self.current_job and self.current_job.key == key and not self.current_job.cancelled:
+                return self.current_job
+            job = Job(self, key, func, args, priority)
+            self._pending[key] = job
+            self._push(job)
+            self._condition.notify()
+            return job
+
+    def _push(self, job):
+        '''push a job on the heap, the counter keeps the order of equal priorities'''
+        self._counter += 1
+        heapq.heappush(self._queue, (job.priority, self._counter, job))
+
+    def cancel(self, key=None):
+        '''cancel the queued and/or running job with the given key, cancels all jobs if no key given'''
+        with self._condition:
+            for job in list(self._pending.values()):
+                if key is None or job.key == key:
+                    job.cancel()
+                    del self._pending[job.key]
+            if self.current_job and (key is None or self.current_job.key == key):
+                self.current_job.cancel()
+
+    def pause(self):
+        '''pause processing, the running job blocks on its next checkpoint'''
+        if self.resume_event.is_set():
+            log_msg("JobWorker %s - paused", xbmc.LOGDEBUG, self.name)
+            self.resume_event.clear()
+
+    def resume(self):
+        '''resume processing after pause'''
+        if not self.resume_event.is_set():
+            log_msg("JobWorker %s - resumed", xbmc.LOGDEBUG, self.name)
+            self.resume_event.set()
+
+    def is_paused(self):
+        '''returns True if the worker is paused'''
+        return not self.resume_event.is_set()
+
+    def is_busy(self):
+        '''returns True if the worker is running a job or has jobs queued'''
+        return bool(self.current_job or self._pending)
+
+    def has_pending(self):
+        '''returns True if there are jobs queued (not counting the running job)'''
+        return bool(self._pending)
+
+    def stop(self):
+        '''stop the worker, the running job is cancelled'''
+        with self._condition:
+            self.exit = True
+            self._condition.notify_all()
+        self.cancel()
+        self.resume_event.set()
+
+    def _next_job(self):
+        '''blocks until a job is available, returns None on exit'''
+        with self._condition:
+            while not self.exit:
+                while self._queue:
+                    priority, _, job = heapq.heappop(self._queue)
+                    if job.cancelled or self._pending.get(job.key) is not job or priority != job.priority:
+                        # stale queue entry
+                        continue
+                    del self._pending[job.key]
+                    self.current_job = job
+                    return job
+                self._condition.wait(5)
+            return None
+
+    def run(self):
+        '''process jobs until stopped'''
+        while not self.exit:
+            job = self._next_job()
+            if not job:
+                break
+            if not job.checkpoint():
+                self.current_job = None
+                continue
+            try:
+                job.func(job, *job.args)
+                if not job.cancelled:
+                    job.set_progress(100)
+            except Exception as exc:
+                log_exception(__name__, exc)
+            finally:
+                self.current_job = None
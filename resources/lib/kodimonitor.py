@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Monitor for Kodi events, passes the library and pvr notifications to the background service
+'''
+
+import xbmc
+import json
+
+LIBRARY_NOTIFICATIONS = [
+    "VideoLibrary.OnUpdate",
+    "VideoLibrary.OnScanFinished",
+    "VideoLibrary.OnCleanFinished",
+    "AudioLibrary.OnUpdate",
+    "AudioLibrary.OnScanFinished",
+    "AudioLibrary.OnCleanFinished"]
+
+# pvr recordings are announced in the VideoLibrary namespace with the recording type in the data
+RECORDING_NOTIFICATIONS = [
+    "VideoLibrary.OnUpdate",
+    "VideoLibrary.OnRemove"]
+PVR_NOTIFICATIONS = [
+    "PVR.OnScanFinished"]
+
+
+class KodiMonitor(xbmc.Monitor):
+    '''Monitor for Kodi events'''
+    bgupdater = None
+
+    def __init__(self, *args, **kwargs):
+        xbmc.Monitor.__init__(self)
+
+    def onNotification(self, sender, method, data):
+        '''builtin function for the xbmc.Monitor class'''
+        if not self.bgupdater:
+            return
+        if method in RECORDING_NOTIFICATIONS and get_item_type(data) == "recording":
+            # a recording was watched, resumed or deleted
+            self.bgupdater.on_pvr_changed(method)
+        elif method in PVR_NOTIFICATIONS:
+            # a channel scan finished
+            self.bgupdater.on_pvr_changed(method)
+        elif method in LIBRARY_NOTIFICATIONS:
+            self.bgupdater.on_library_changed(method)
+
+
+def get_item_type(data):
+    '''returns the type of the item in the data of a library notification'''
+    try:
+        data = json.loads(data)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    # OnUpdate passes the item in an item object, OnRemove passes the id and type directly
+    item = data.get("item") if isinstance(data.get("item"), dict) else data
+    return item.get("type")
@@ -0,0 +1,323 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Image pools: the images fetched for a single (canonical) source.
+    All win_props which resolve to the same source share one pool,
+    each win_prop walks through the pool with its own cursor which avoids the images it showed recently.
+    The PoolStore holds all pools and cursors and may be used from multiple threads.
+    Global backgrounds sample from an AggregatePool: a size-weighted index over the member pools.
+'''
+
+from collections import deque
+import bisect
+import random
+import threading
+
+HISTORY_SIZE = 20  # an image is not shown again for the same win_prop within this number of rotations
+MAX_PASSES = 3  # number of times a (large) pool is cycled before it is refilled
+
+
+class ImagePool(object):
+    '''the images fetched for a single source'''
+
+    def __init__(self, source_key, images, small=False):
+        self.source_key = source_key
+        self.images = images
+        # the history is keyed on the fanart, which may be shared by many images (e.g. episodes of one show)
+        self.distinct_keys = len(set(image.get("fanart") for image in images))
+        # small pools did not return enough images to be refreshed, images are picked randomly forever
+        self.small = small
+        # an expired pool is not cycled again, the next win_prop which went through it triggers a refill
+        # (a small pool is refilled on the next take)
+        self.expired = False
+
+    def new_cursor(self, history=None, max_passes=1):
+        '''returns a new cursor for a win_prop drawing from this pool'''
+        return PoolCursor(self, history or RecentHistory(0), max_passes)
+
+
+class RecentHistory(object):
+    '''the images recently shown for a win_prop: a ring buffer for the order and a set for fast lookups'''
+
+    def __init__(self, size):
+        self.size = size
+        self.recent = deque()
+        self.lookup = set()
+
+    def add(self, image):
+        '''remember an image, the oldest image is forgotten once the history is full'''
+        if not self.size:
+            return
+        key = image.get("fanart")
+        if key in self.lookup:
+            # shown again anyway (tiny pool), move it to the end
+            self.recent.remove(key)
+        elif len(self.recent) >= self.size:
+            self.lookup.discard(self.recent.popleft())
+        self.recent.append(key)
+        self.lookup.add(key)
+
+    def contains(self, image, window=None):
+        '''returns True if the image is one of the last (window) images shown'''
+        key = image.get("fanart")
+        if key not in self.lookup:
+            return False
+        if window is None or window >= len(self.recent):
+            return True
+        return window > 0 and key in list(self.recent)[-window:]
+
+    def get_recent(self, window=None):
+        '''returns the keys of the last (window) images shown'''
+        if window is None:
+            return list(self.recent)
+        return list(self.recent)[-window:] if window > 0 else []
+
+
+class PoolCursor(object):
+    '''position of a single win_prop in a (shared) pool
+       the cursor walks the pool in its own random order, so win_props sharing the pool do not
+       show the same image at the same time, and does not return an image which is in the recent
+       history of the win_prop; a pool is cycled up to max_passes times before it needs a refill
+       the cursor looks ahead so the upcoming image can be announced to the skin (and prepared before that)'''
+
+    def __init__(self, pool, history, max_passes=1):
+        self.pool = pool
+        self.history = history
+        self.max_passes = max_passes
+        self.passes = 0
+        self.order = []
+        self.position = 0
+        self.upcoming = deque()  # the images taken ahead, returned by the next calls to next()
+        self.new_pass()
+
+    def new_pass(self):
+        '''start a new pass through the pool in a new random order'''
+        self.passes += 1
+        self.order = list(range(len(self.pool.images)))
+        random.shuffle(self.order)
+        self.position = 0
+
+    def next(self):
+        '''returns the next image for the win_prop, None if the win_prop went through the whole pool'''
+        image = self.peek()
+        if image:
+            self.upcoming.popleft()
+        return image
+
+    def peek(self, depth=1):
+        '''returns the image which will be returned by the depth-th next call to next() without consuming it'''
+        while len(self.upcoming) < depth:
+            image = self.take()
+            if not image:
+                return None
+            self.upcoming.append(image)
+        return self.upcoming[depth - 1]
+
+    def take(self):
+        '''take the next image from the pool'''
+        images = self.pool.images
+        if not images:
+            return None
+        if self.pool.small:
+            if self.pool.expired:
+                # small pools are never cycled, an expired one must be refilled right away
+                return None
+            image = self.take_random(images)
+        else:
+            if self.position >= len(self.order):
+                if self.passes >= self.max_passes or self.pool.expired:
+                    return None
+                self.new_pass()
+            index = self.find_unseen()
+            if index is not None:
+                # swap the image which was not shown recently into the current position
+                self.order[self.position], self.order[index] = self.order[index], self.order[self.position]
+            image = images[self.order[self.position]]
+            self.position += 1
+        self.history.add(image)
+        return image
+
+    def find_unseen(self):
+        '''returns the index in the order of the first image of the remaining pass which was not shown recently,
+           None if all of them were shown recently (the current image is used anyway)'''
+        images = self.pool.images
+        window = self.get_window()
+        for index in range(self.position, len(self.order)):
+            if not self.history.contains(images[self.order[index]], window):
+                return index
+        return None
+
+    def get_window(self):
+        '''returns the number of recent images to avoid
+           a pool with fewer distinct images than the history can only avoid the most recent ones'''
+        return min(self.history.size, self.pool.distinct_keys - 1)
+
+    def take_random(self, images):
+        '''pick a random image from a small pool which was not shown recently'''
+        window = self.get_window()
+        candidates = [image for image in images if not self.history.contains(image, window)]
+        return random.choice(candidates or images)
+
+
+class PoolStore(object):
+    '''thread-safe store of the image pools (by source) and the cursors (by win_prop)
+       pools are never modified once stored: a refill replaces the pool (copy-on-write),
+       so readers can use the images of a pool without holding a lock'''
+
+    def __init__(self):
+        self.lock = threading.RLock()  # protects the dicts and the cursors
+        self.pools = {}  # source_key --> ImagePool, shared by all win_props with the same source
+        self.cursors = {}  # win_prop --> PoolCursor
+        self.sources = {}  # win_prop --> source_key
+        self.refill_locks = {}  # source_key --> lock held while the pool is refilled
+        self.aggregates = {}  # global win_prop --> AggregatePool
+        self.version = 0  # incremented on every change of the pools or sources, invalidates the aggregates
+        self.histories = {}  # win_prop --> RecentHistory
+
+    def get_pool(self, source_key):
+        '''returns the current pool of the source, None if there is none'''
+        with self.lock:
+            return self.pools.get(source_key)
+
+    def get_images(self, win_prop):
+        '''returns the images in the pool of the win_prop (snapshot, do not modify)'''
+        with self.lock:
+            pool = self.pools.get(self.sources.get(win_prop))
+            return pool.images if pool else []
+
+    def take(self, win_prop, source_key):
+        '''atomically take the next image for the win_prop from the pool of its source,
+           returns None if there is no pool or the win_prop went through the whole pool'''
+        with self.lock:
+            if self.sources.get(win_prop) != source_key:
+                self.sources[win_prop] = source_key
+                self.version += 1
+            pool = self.pools.get(source_key)
+            if not pool:
+                return None
+            cursor = self.cursors.get(win_prop)
+            if not cursor or cursor.pool is not pool:
+                # first use or the pool has been refreshed in the meanwhile
+                new_cursor = pool.new_cursor(self.get_history(win_prop), MAX_PASSES)
+                if cursor:
+                    # keep the images which were already announced (or prepared) as next images
+                    new_cursor.upcoming = cursor.upcoming
+                cursor = new_cursor
+                self.cursors[win_prop] = cursor
+            return cursor.next()
+
+    def get_history(self, win_prop):
+        '''returns the recent history of the win_prop'''
+        history = self.histories.get(win_prop)
+        if not history:
+            history = self.histories[win_prop] = RecentHistory(HISTORY_SIZE)
+        return history
+
+    def expire(self, source_key=None):
+        '''expire all pools (or the pool of the given source), e.g. when the library changed,
+           so they are refilled once a win_prop went through them'''
+        with self.lock:
+            for pool in self.pools.values():
+                if source_key is None or pool.source_key == source_key:
+                    pool.expired = True
+
+    def peek(self, win_prop, depth=1):
+        '''returns the upcoming image of the win_prop (or the one depth rotations ahead) without taking it'''
+        with self.lock:
+            cursor = self.cursors.get(win_prop)
+            return cursor.peek(depth) if cursor else None
+
+    def refill(self, source_key, stale_pool, fetch, small_size):
+        '''replace the stale pool of the source with the images returned by fetch()
+           only one thread fetches for a source at a time, a thread waiting for the refill
+           of another thread uses that pool instead of fetching again
+           returns a tuple of the current pool and a bool which is True if this call fetched the images'''
+        with self.lock:
+            refill_lock = self.refill_locks.setdefault(source_key, threading.Lock())
+        with refill_lock:
+            pool = self.get_pool(source_key)
+            if pool is not stale_pool:
+                # refilled by another thread in the meanwhile
+                return pool, False
+            images = fetch()
+            if not images:
+                return None, True
+            # paths which did not return enough images are stored as small pool which will not be flushed
+            pool = ImagePool(source_key, images, len(images) < small_size)
+            with self.lock:
+                self.pools[source_key] = pool
+                self.version += 1
+            return pool, True
+
+    def sample(self, key, win_prop):
+        '''returns a random image from the pool of the win_prop without moving the cursor of the win_prop,
+           used by other consumers of the pool (e.g. manual walls) which keep their own history under key'''
+        return self.sample_aggregate(key, [win_prop])
+
+    def sample_aggregate(self, win_prop, members):
+        '''returns a random image from the pools of the member win_props of a global background,
+           each image has the same chance to be picked regardless of the size of its pool'''
+        with self.lock:
+            aggregate = self.aggregates.get(win_prop)
+            if not aggregate or aggregate.members != members:
+                aggregate = AggregatePool(members)
+                self.aggregates[win_prop] = aggregate
+            if aggregate.version != self.version:
+                # a member pool was refilled: rebuild the index
+                aggregate.update([self.pools.get(self.sources.get(member)) for member in members])
+                aggregate.version = self.version
+            history = self.get_history(win_prop)
+            # an aggregate with fewer distinct images than the history can only avoid the most recent ones
+            window = min(history.size, len(aggregate.positions) - 1)
+            image = aggregate.sample(history.get_recent(window)) or aggregate.sample()
+            if image:
+                history.add(image)
+            return image
+
+
+class AggregatePool(object):
+    '''size-weighted index over the pools of the members of a global background'''
+
+    def __init__(self, members):
+        self.members = list(members)
+        self.version = None
+        self.pools = []
+        self.cumulative = []  # cumulative number of images up to and including each pool
+        self.positions = {}  # image key --> positions of the image in the index
+
+    def update(self, pools):
+        '''rebuild the index for the current member pools'''
+        self.pools = []
+        self.cumulative = []
+        self.positions = {}
+        total = 0
+        for pool in pools:
+            # members which share a source share the pool, count its images only once
+            if pool and pool.images and not any(pool is other for other in self.pools):
+                for offset, image in enumerate(pool.images):
+                    self.positions.setdefault(image.get("fanart"), []).append(total + offset)
+                total += len(pool.images)
+                self.pools.append(pool)
+                self.cumulative.append(total)
+
+    def size(self):
+        '''returns the number of images in all member pools'''
+        return self.cumulative[-1] if self.cumulative else 0
+
+    def sample(self, exclude=()):
+        '''returns a random image from all member pools which is not one of the excluded image keys,
+           None if there is no such image'''
+        excluded = sorted(set(position for key in exclude for position in self.positions.get(key, [])))
+        if self.size() <= len(excluded):
+            return None
+        # pick from the remaining positions only, so every candidate has the same chance without retries
+        position = random.randrange(self.size() - len(excluded))
+        for excluded_position in excluded:
+            if excluded_position > position:
+                break
+            position += 1
+        index = bisect.bisect_right(self.cumulative, position)
+        offset = position - (self.cumulative[index - 1] if index else 0)
+        return self.pools[index].images[offset]
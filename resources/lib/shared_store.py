@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Shared artefact store for multiple Kodi clients on the same library.
+    One client builds an artefact (e.g. the wall images of a collection or a pool snapshot) and
+    publishes it in a shared directory (NFS/SMB mount) together with a manifest with the content
+    hashes of the files, the other clients reuse the published artefact instead of building it.
+    Building is coordinated with lock files created with O_EXCL.
+    This module only uses the standard library so it can be used (and tested) without Kodi.
+'''
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+
+LOCK_TIMEOUT = 1800  # a lock older than this (in seconds) is considered stale, e.g. the client crashed
+MANIFEST = "manifest.json"
+
+
+class SharedStore(object):
+    '''artefact store in a directory shared by multiple clients'''
+
+    def __init__(self, path, client_id=None, lock_timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.client_id = client_id or "%s-%s" % (socket.gethostname(), os.getpid())
+        self.lock_timeout = lock_timeout
+
+    def get_dir(self, name):
+        '''returns the directory of the artefact with the given name'''
+        return os.path.join(self.path, name)
+
+    def acquire(self, name):
+        '''try to get the build lock of an artefact, returns False if another client holds the lock'''
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        lock_file = os.path.join(self.path, "%s.lock" % name)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+                if not self.break_stale_lock(lock_file):
+                    return False
+                continue
+            try:
+                os.write(fd, json.dumps({"client": self.client_id, "time": time.time()}).encode("utf-8"))
+            finally:
+                os.close(fd)
+            return True
+        return False
+
+    def break_stale_lock(self, lock_file):
+        '''remove the lock file if it is older than the lock timeout, returns True if removed'''
+        try:
+            if time.time() - os.stat(lock_file).st_mtime < self.lock_timeout:
+                return False
+            os.remove(lock_file)
+        except OSError:
+            # removed by another client in the meanwhile
+            pass
+        return True
+
+    def release(self, name):
+        '''release the build lock of an artefact'''
+        try:
+            os.remove(os.path.join(self.path, "%s.lock" % name))
+        except OSError:
+            pass
+
+    def publish(self, name, files=(), data=None):
+        '''publish an artefact: copy the given (local) files to the store and write the manifest
+           the manifest is written last so other clients never see a partial artefact'''
+        artefact_dir = self.get_dir(name)
+        if not os.path.isdir(artefact_dir):
+            os.makedirs(artefact_dir)
+        hashes = {}
+        for file in files:
+            filename = os.path.basename(file)
+            tmp_file = os.path.join(artefact_dir, ".%s.tmp" % filename)
+            shutil.copyfile(file, tmp_file)
+            replace(tmp_file, os.path.join(artefact_dir, filename))
+            hashes[filename] = get_file_hash(os.path.join(artefact_dir, filename))
+        manifest = {"name": name, "client": self.client_id, "created": time.time(), "files": hashes, "data": data}
+        tmp_file = os.path.join(artefact_dir, ".%s.tmp" % MANIFEST)
+        with open(tmp_file, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        replace(tmp_file, os.path.join(artefact_dir, MANIFEST))
+        # remove the files of a previous version of the artefact
+        for filename in os.listdir(artefact_dir):
+            if filename not in hashes and filename != MANIFEST and not filename.startswith("."):
+                try:
+                    os.remove(os.path.join(artefact_dir, filename))
+                except OSError:
+                    pass
+        return manifest
+
+    def get_manifest(self, name, max_age=None):
+        '''returns the manifest of the published artefact, None if not published or older than max_age'''
+        try:
+            with open(os.path.join(self.get_dir(name), MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if max_age and time.time() - manifest.get("created", 0) > max_age:
+            return None
+        return manifest
+
+    def get_manifest_time(self, name):
+        '''returns the modification time of the manifest of the artefact, None if not published
+           cheap compared to get_manifest, so clients can skip reading a manifest they have seen'''
+        try:
+            return os.stat(os.path.join(self.get_dir(name), MANIFEST)).st_mtime
+        except OSError:
+            return None
+
+    def fetch(self, name, dest_dir, max_age=None):
+        '''copy the files of the published artefact to the (local) destination directory
+           files are verified against the hashes in the manifest, files which already exist locally
+           with the same content are not copied again
+           returns the manifest, None if the artefact is not (completely) available'''
+        manifest = self.get_manifest(name, max_age)
+        if not manifest:
+            return None
+        artefact_dir = self.get_dir(name)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        for filename, file_hash in manifest["files"].items():
+            dest_file = os.path.join(dest_dir, filename)
+            if os.path.exists(dest_file) and get_file_hash(dest_file) == file_hash:
+                continue
+            tmp_file = os.path.join(dest_dir, ".%s.tmp" % filename)
+            try:
+                shutil.copyfile(os.path.join(artefact_dir, filename), tmp_file)
+            except (IOError, OSError):
+                # replaced by a newer version in the meanwhile
+                return None
+            if get_file_hash(tmp_file) != file_hash:
+                os.remove(tmp_file)
+                return None
+            replace(tmp_file, dest_file)
+        return manifest
+
+
+def get_file_hash(filename):
+    '''returns the sha1 of the file contents'''
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def replace(src, dest):
+    '''rename src to dest, replacing dest if it exists'''
+    if hasattr(os, "replace"):
+        os.replace(src, dest)
+    else:
+        # python 2
+        if os.path.exists(dest):
+            os.remove(dest)
+        os.rename(src, dest)
+
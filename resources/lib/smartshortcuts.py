@@ -11,47 +11,102 @@ The most important behaviour of the smart shortcuts feature is that is pulls ima
 so you can have content based backgrounds.
 '''
 
-from .utils import get_content_path, log_msg, log_exception, ADDON_ID
+from .utils import get_content_path, get_addon_version, log_msg, log_exception, ADDON_ID
 import xbmc
 import xbmcvfs
 import xbmcaddon
-import os, sys
+import threading
+import hashlib
+import io
+from collections import OrderedDict
+import xml.etree.ElementTree as xmltree
+
+PLAYLISTS_CACHE = "skinhelper.backgrounds.playlists"
+FAVOURITES_CACHE = "skinhelper.backgrounds.favourites"
+FAVOURITES_FILE = "special://profile/favourites.xml"
+PLEX_INIT_TIMEOUT = 10  # max seconds to wait for the plex addon to publish its nodes
+
 
 class SmartShortCuts():
     '''Smart shortcuts listings'''
     exit = False
-    all_nodes = {}
-    toplevel_nodes = []
-    build_busy = False
+    submenu_template = None
 
     def __init__(self, bgupdater):
         self.bgupdater = bgupdater
+        self.lock = threading.RLock()
+        self.all_nodes = {}  # provider --> nodes
+        self.build_busy = False
+        self.toplevel_nodes = OrderedDict()  # used as ordered set
+        self.pending_submenus = OrderedDict()
+        self.submenu_hashes = {}  # submenu file --> (mtime and size, hash of the contents) of the file on disk
 
     def get_smartshortcuts_nodes(self):
         '''return all smartshortcuts paths for which an image should be generated'''
         nodes = []
-        if sys.version_info.major == 3:
-            for value in self.all_nodes.values():
-                nodes += value
-        else:
-            for value in self.all_nodes.itervalues():
+        with self.lock:
+            for value in list(self.all_nodes.values()):
                 nodes += value
         return nodes
 
     def build_smartshortcuts(self):
-        '''build all smart shortcuts nodes - only proceed if build is not already in process'''
-        if self.exit or self.build_busy:
+        '''build all smart shortcuts nodes - only proceed if build is not already in process
+           the providers run concurrently on worker threads so the backgrounds rotation is never paused'''
+        if not self.start_build():
             return
-        else:
+        threads = []
+        for provider in self.get_providers():
+            thread = threading.Thread(target=self.run_provider, args=(provider,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        thread = threading.Thread(target=self.finish_build, args=(threads,))
+        thread.daemon = True
+        thread.start()
+
+    def start_build(self):
+        '''mark the start of a build, returns False if a build is already in progress'''
+        with self.lock:
+            if self.exit or self.build_busy:
+                return False
             self.build_busy = True
-            # build all smart shortcuts nodes
-            self.emby_nodes()
-            self.playlists_nodes()
-            self.favourites_nodes()
-            self.plex_nodes()
+            return True
+
+    def get_providers(self):
+        '''returns all smart shortcuts providers'''
+        return [self.emby_nodes, self.playlists_nodes, self.favourites_nodes, self.plex_nodes]
+
+    def run_provider(self, provider):
+        '''run a single smart shortcuts provider on a worker thread'''
+        try:
+            provider()
+        except Exception as exc:
+            log_exception(__name__, exc)
+
+    def finish_build(self, threads=()):
+        '''wait for all providers to finish and report the result'''
+        for thread in threads:
+            thread.join()
+        if not self.exit:
+            self.write_smartshortcuts_submenus()
             # set all toplevel nodes in window prop for exchange with skinshortcuts
-            self.bgupdater.set_winprop("all_smartshortcuts", repr(self.toplevel_nodes))
-            self.build_busy = False
+            with self.lock:
+                toplevel_nodes = repr(list(self.toplevel_nodes))
+            self.bgupdater.set_winprop("all_smartshortcuts", toplevel_nodes)
+            # report the backgrounds of the new nodes and store the window props for the next startup
+            self.bgupdater.report_allbackgrounds()
+            self.bgupdater.winpropcache(True)
+        self.build_busy = False
+
+    def set_nodes(self, provider, nodes):
+        '''atomically store the nodes of a provider'''
+        with self.lock:
+            self.all_nodes[provider] = nodes
+
+    def add_toplevel_node(self, key):
+        '''add a key to the toplevel nodes (if not already present)'''
+        with self.lock:
+            self.toplevel_nodes[key] = None
 
     def emby_nodes(self):
         '''build smart shortcuts for the emby addon'''
@@ -84,12 +139,11 @@ class SmartShortCuts():
                                 content = get_content_path(item_path)
                                 nodes.append(("%s.image" % key, content, label))
                                 if content_string == "":
-                                    if "emby.nodes.%s" % count not in self.toplevel_nodes:
-                                        self.toplevel_nodes.append("emby.nodes.%s" % count)
+                                    self.add_toplevel_node("emby.nodes.%s" % count)
                                     self.create_smartshortcuts_submenu(
                                         "emby.nodes.%s" % count, "special://home/addons/plugin.video.emby/icon.png")
-                log_msg("Generated smart shortcuts for emby nodes: %s" % nodes)
-                self.all_nodes["emby"] = nodes
+                log_msg("Generated smart shortcuts for emby nodes: %s", xbmc.LOGDEBUG, nodes)
+                self.set_nodes("emby", nodes)
 
     def plex_nodes(self):
         '''build smart shortcuts listing for the (legacy) plex addon'''
@@ -97,9 +151,13 @@ class SmartShortCuts():
             nodes = []
             if xbmc.getCondVisibility("System.HasAddon(plugin.video.plexbmc) + Skin.HasSetting(SmartShortcuts.plex)"):
                 xbmc.executebuiltin('RunScript(plugin.video.plexbmc,amberskin)')
-                # wait a few seconds for the initialization to be finished
+                # wait for the initialization to be finished, the plex addon publishes its nodes in window props
                 monitor = xbmc.Monitor()
-                monitor.waitForAbort(5)
+                waited = 0.0
+                while not self.bgupdater.win.getProperty("plexbmc.0.title") and waited < PLEX_INIT_TIMEOUT:
+                    if self.exit or monitor.waitForAbort(0.25):
+                        break
+                    waited += 0.25
                 del monitor
 
                 # get the plex setting if there are subnodes
@@ -150,8 +208,7 @@ class SmartShortCuts():
                         elif content_string == "":
                             if media_type == "show":
                                 media_type = "tvshows"
-                            if key not in self.toplevel_nodes:
-                                self.toplevel_nodes.append(key)
+                            self.add_toplevel_node(key)
                             self.create_smartshortcuts_submenu("plexbmc.%s" % i,
                                                                "special://home/addons/plugin.video.plexbmc/icon.png")
 
@@ -191,9 +248,8 @@ class SmartShortCuts():
                     self.bgupdater.set_winprop("%s.path" % key, item_path)
                     self.bgupdater.set_winprop("%s.content" % key, content)
                     self.bgupdater.set_winprop("%s.type" % key, "episodes")
-                    if key not in self.toplevel_nodes:
-                        self.toplevel_nodes.append(key)
-                self.all_nodes["plex"] = nodes
+                    self.add_toplevel_node(key)
+                self.set_nodes("plex", nodes)
 
     def playlists_nodes(self):
         '''build smart shortcuts listing for playlists'''
@@ -201,7 +257,9 @@ class SmartShortCuts():
         if xbmc.getCondVisibility("Skin.HasSetting(SmartShortcuts.playlists)"):
             # build node listing
             count = 0
-            import xml.etree.ElementTree as xmltree
+            # parsed playlists are cached by path, unchanged playlists (same mtime and size) are not read again
+            playlists_cache = self.bgupdater.cache.get(PLAYLISTS_CACHE) or {}
+            new_playlists_cache = {}
             paths = [('special://videoplaylists/', 'Videos'), ('special://musicplaylists/', 'Music')]
             for playlistpath in paths:
                 if xbmcvfs.exists(playlistpath[0]):
@@ -211,17 +269,16 @@ class SmartShortCuts():
                             label = ""
                             if item["file"].endswith(".xsp") and "Emby" not in item["file"]:
                                 playlist = item["file"]
-                                contents = xbmcvfs.File(playlist, 'r')
-                                contents_data = contents.read()
-                                contents.close()
-                                xmldata = xmltree.fromstring(contents_data)
-                                media_type = "unknown"
-                                label = item["label"]
-                                for line in xmldata.getiterator():
-                                    if line.tag == "smartplaylist":
-                                        media_type = line.attrib['type']
-                                    if line.tag == "name":
-                                        label = line.text
+                                stat = xbmcvfs.Stat(playlist)
+                                checksum = "%s-%s" % (stat.st_mtime(), stat.st_size())
+                                cache = playlists_cache.get(playlist)
+                                if cache and cache["checksum"] == checksum:
+                                    media_type = cache["type"]
+                                    label = cache["label"]
+                                else:
+                                    media_type, label = self.parse_playlist(playlist, item["label"])
+                                new_playlists_cache[playlist] = {"checksum": checksum, "type": media_type,
+                                                                 "label": label}
                                 key = "playlist.%s" % count
                                 item_path = "ActivateWindow(%s,%s,return)" % (playlistpath[1], playlist)
                                 self.bgupdater.set_winprop("%s.label" % key, label)
@@ -231,14 +288,35 @@ class SmartShortCuts():
                                 self.bgupdater.set_winprop("%s.content" % key, playlist)
                                 self.bgupdater.set_winprop("%s.type" % key, media_type)
                                 nodes.append(("%s.image" % key, playlist, label))
-                                if key not in self.toplevel_nodes:
-                                    self.toplevel_nodes.append(key)
+                                self.add_toplevel_node(key)
                                 count += 1
                         except Exception:
                             log_msg("Error while processing smart shortcuts for playlist %s  --> "
                                     "This file seems to be corrupted, please remove it from your system "
                                     "to prevent any further errors." % item["file"], xbmc.LOGINFO)
-            self.all_nodes["playlists"] = nodes
+            if new_playlists_cache != playlists_cache:
+                self.bgupdater.cache.set(PLAYLISTS_CACHE, new_playlists_cache)
+            self.set_nodes("playlists", nodes)
+
+    @staticmethod
+    def parse_playlist(playlist, label):
+        '''get the media type and name of a smart playlist, parsing stops as soon as both are found'''
+        media_type = "unknown"
+        name = None
+        contents = xbmcvfs.File(playlist, 'r')
+        try:
+            contents_data = bytes(contents.readBytes())
+        finally:
+            contents.close()
+        for event, elem in xmltree.iterparse(io.BytesIO(contents_data), events=("start", "end")):
+            if event == "start" and elem.tag == "smartplaylist":
+                media_type = elem.attrib['type']
+            elif event == "end" and elem.tag == "name":
+                name = elem.text
+                break
+        if name is not None:
+            label = name
+        return media_type, label
 
     def favourites_nodes(self):
         '''build smart shortcuts for favourites'''
@@ -246,6 +324,13 @@ class SmartShortCuts():
             # build node listing
             nodes = []
             favs = self.bgupdater.mutils.kodidb.favourites()
+            # detected content types are cached by path and addon version as long as the favourites are unchanged
+            favourites_cache = self.bgupdater.cache.get(FAVOURITES_CACHE) or {}
+            stat = xbmcvfs.Stat(FAVOURITES_FILE)
+            checksum = "%s-%s" % (stat.st_mtime(), stat.st_size())
+            if favourites_cache.get("checksum") != checksum:
+                favourites_cache = {"checksum": checksum, "types": {}}
+            media_types = {}
             for count, fav in enumerate(favs):
                 if fav["type"] == "window":
                     content = fav["windowparameter"]
@@ -257,7 +342,12 @@ class SmartShortCuts():
                         item_path = "ActivateWindow(%s,%s,return)" % (fav["window"], content)
                         if "&" in content and "?" in content and "=" in content and not content.endswith("/"):
                             content += "&widget=true"
-                        media_type = self.bgupdater.mutils.detect_plugin_content(content)
+                        cache_key = "%s|%s" % (content, get_addon_version(content))
+                        if cache_key in favourites_cache["types"]:
+                            media_type = favourites_cache["types"][cache_key]
+                        else:
+                            media_type = self.bgupdater.mutils.detect_plugin_content(content)
+                        media_types[cache_key] = media_type
                         if media_type:
                             key = "favorite.%s" % count
                             self.bgupdater.set_winprop("%s.label" % key, fav["label"])
@@ -266,29 +356,67 @@ class SmartShortCuts():
                             self.bgupdater.set_winprop("%s.path" % key, item_path)
                             self.bgupdater.set_winprop("%s.content" % key, content)
                             self.bgupdater.set_winprop("%s.type" % key, media_type)
-                            if key not in self.toplevel_nodes:
-                                self.toplevel_nodes.append(key)
+                            self.add_toplevel_node(key)
                             nodes.append(("%s.image" % key, content, fav["label"]))
-            self.all_nodes["favourites"] = nodes
+            if media_types != favourites_cache["types"]:
+                favourites_cache["types"] = media_types
+                self.bgupdater.cache.set(FAVOURITES_CACHE, favourites_cache)
+            self.set_nodes("favourites", nodes)
 
-    @staticmethod
-    def create_smartshortcuts_submenu(win_prop, icon_image):
-        '''helper to create a skinshortcuts submenu for the top level smart shortcut node'''
+    def create_smartshortcuts_submenu(self, win_prop, icon_image):
+        '''helper to create a skinshortcuts submenu for the top level smart shortcut node
+           the submenus are written in one batch when the smart shortcuts build is finished'''
+        with self.lock:
+            self.pending_submenus[win_prop] = icon_image
+
+    def write_smartshortcuts_submenus(self):
+        '''write the pending skinshortcuts submenus, files are only written if the content changed'''
+        with self.lock:
+            submenus = list(self.pending_submenus.items())
+            self.pending_submenus.clear()
+        if not submenus:
+            return
         try:
             if xbmcvfs.exists("special://skin/shortcuts/"):
-                shortcutsfile = "special://home/addons/script.skinshortcuts/resources/shortcuts/"\
-                    "info-window-home-property-%s-title.DATA.xml" % win_prop.replace(".", "-")
-                templatefile = "special://home/addons/%s/resources/smartshortcuts/smartshortcuts-submenu-template.xml" \
-                    % (ADDON_ID)
-                # read template file
-                templatefile = xbmcvfs.File(templatefile)
-                data = templatefile.read()
-                templatefile.close()
-                # write shortcuts file
-                shortcutsfile = xbmcvfs.File(shortcutsfile, "w")
-                data = data.replace("WINDOWPROP", win_prop)
-                data = data.replace("ICONIMAGE", icon_image)
-                shortcutsfile.write(data)
-                shortcutsfile.close()
+                template = self.get_submenu_template()
+                for win_prop, icon_image in submenus:
+                    shortcutsfile = "special://home/addons/script.skinshortcuts/resources/shortcuts/"\
+                        "info-window-home-property-%s-title.DATA.xml" % win_prop.replace(".", "-")
+                    data = template.replace("WINDOWPROP", win_prop)
+                    data = data.replace("ICONIMAGE", icon_image)
+                    data_hash = hashlib.md5(data.encode("utf-8")).hexdigest()
+                    if self.get_file_hash(shortcutsfile) == data_hash:
+                        continue
+                    # write shortcuts file
+                    shortcutsfile_obj = xbmcvfs.File(shortcutsfile, "w")
+                    shortcutsfile_obj.write(data)
+                    shortcutsfile_obj.close()
         except Exception as exc:
             log_exception(__name__, exc)
+
+    def get_file_hash(self, filename):
+        '''returns the hash of the contents of the file on disk, None if the file does not exist
+           the file is only read again if it changed on disk (e.g. skinshortcuts was updated or reset)'''
+        if not xbmcvfs.exists(filename):
+            self.submenu_hashes.pop(filename, None)
+            return None
+        stat = xbmcvfs.Stat(filename)
+        checksum = "%s-%s" % (stat.st_mtime(), stat.st_size())
+        if self.submenu_hashes.get(filename, (None, None))[0] != checksum:
+            file = xbmcvfs.File(filename)
+            try:
+                data = file.read()
+            finally:
+                file.close()
+            self.submenu_hashes[filename] = (checksum, hashlib.md5(data.encode("utf-8")).hexdigest())
+        return self.submenu_hashes[filename][1]
+
+    def get_submenu_template(self):
+        '''read the submenu template file (only once)'''
+        if self.submenu_template is None:
+            templatefile = "special://home/addons/%s/resources/smartshortcuts/smartshortcuts-submenu-template.xml" \
+                % (ADDON_ID)
+            templatefile = xbmcvfs.File(templatefile)
+            self.submenu_template = templatefile.read()
+            templatefile.close()
+        return self.submenu_template
@@ -8,20 +8,83 @@ import xbmc
 import sys
 import urllib
 import traceback
+import time
+from collections import deque
 from traceback import format_exc
+try:
+    import reprlib
+except ImportError:
+    # python 2
+    import repr as reprlib
 
 ADDON_ID = "script.skin.helper.backgrounds"
+DEBUG_LOG = False  # debug logging enabled in Kodi
+FORCE_DEBUG_LOG = False  # debug logging enabled in the addon settings, logs debug messages at info level
+LOG_BUFFER = deque(maxlen=500)  # ring buffer with the recent debug events
+LOG_BUFFER_MSG_SIZE = 1000  # string args of the debug messages are truncated to this size in the ring buffer
+LOG_BUFFER_REPR = reprlib.Repr()  # bounded repr of the other args kept in the ring buffer
+LOG_BUFFER_REPR.maxstring = LOG_BUFFER_MSG_SIZE
+LOG_BUFFER_REPR.maxother = LOG_BUFFER_MSG_SIZE
+LOG_SAMPLES = {}
+CONTENT_PATHS = {}  # memoized results of get_content_path
 
 
-def log_msg(msg, loglevel=xbmc.LOGINFO):
-    """log message to kodi logfile"""
+def log_msg(msg, loglevel=xbmc.LOGINFO, *args):
+    """log message to kodi logfile
+       formatting with args is deferred: debug messages are only formatted if debug logging is enabled"""
+    if loglevel == xbmc.LOGDEBUG:
+        # recent debug events are always kept in the ring buffer so they can be dumped on demand
+        # the args are bounded so the buffer does not hold on to (large) objects
+        LOG_BUFFER.append((time.time(), msg, tuple(bound_log_arg(arg) for arg in args)))
+        if FORCE_DEBUG_LOG:
+            loglevel = xbmc.LOGINFO
+        elif not DEBUG_LOG:
+            return
+    if args:
+        msg = format_log_msg(msg, args)
     if sys.version_info.major < 3:
         if isinstance(msg, unicode):
             msg = msg.encode('utf-8')
-    if loglevel == xbmc.LOGDEBUG and FORCE_DEBUG_LOG:
-        loglevel = xbmc.LOGINFO
     xbmc.log("Skin Helper Backgrounds --> %s" % msg, level=loglevel)
 
+def bound_log_arg(arg):
+    """returns a small copy of a log arg for the ring buffer: truncated strings and a bounded repr of objects"""
+    if arg is None or isinstance(arg, (bool, int, float)):
+        return arg
+    if isinstance(arg, (str, type(u""))):
+        return arg[:LOG_BUFFER_MSG_SIZE]
+    return LOG_BUFFER_REPR.repr(arg)
+
+def format_log_msg(msg, args):
+    """format the log message with the args, the args are appended if they do not match the message"""
+    try:
+        return msg % args
+    except Exception:
+        return "%s %s" % (msg, repr(args))
+
+def log_sampled(key, rate, msg, loglevel=xbmc.LOGDEBUG, *args):
+    """log only one out of every <rate> messages with the same key, used for messages in hot paths"""
+    count = LOG_SAMPLES.get(key, 0)
+    LOG_SAMPLES[key] = count + 1
+    if count % rate == 0:
+        log_msg(msg, loglevel, *args)
+
+def set_debug_logging(kodi_debug, force_debug=False):
+    """enable or disable the debug messages, force_debug logs them at info level"""
+    global DEBUG_LOG, FORCE_DEBUG_LOG
+    DEBUG_LOG = kodi_debug
+    FORCE_DEBUG_LOG = force_debug
+
+def dump_log_buffer():
+    """write the recent debug events from the ring buffer to the kodi logfile"""
+    events = list(LOG_BUFFER)
+    xbmc.log("Skin Helper Backgrounds --> Dump of the last %s debug events:" % len(events), level=xbmc.LOGINFO)
+    for timestamp, msg, args in events:
+        if args:
+            msg = format_log_msg(msg, args)
+        xbmc.log("Skin Helper Backgrounds --> [%s] %s" % (
+            time.strftime("%H:%M:%S", time.localtime(timestamp)), try_encode(msg)), level=xbmc.LOGINFO)
+
 def log_exception(modulename, exceptiondetails):
     '''helper to properly log an exception'''
     if sys.version_info.major == 3:
@@ -53,6 +116,27 @@ def urlencode(text):
 
 def get_content_path(lib_path):
     '''helper to get the real browsable path'''
+    if "$INFO" in lib_path and "reload=" not in lib_path:
+        # resolved from a window property so it can't be memoized
+        return resolve_content_path(lib_path)
+    content_path = CONTENT_PATHS.get(lib_path)
+    if content_path is None:
+        if len(CONTENT_PATHS) > 1000:
+            CONTENT_PATHS.clear()
+        content_path = resolve_content_path(lib_path)
+        CONTENT_PATHS[lib_path] = content_path
+    return content_path
+
+def get_source_key(lib_path):
+    '''helper to get the canonical key of the source of a path, paths with the same key list the same content'''
+    source_key = get_content_path(lib_path).strip()
+    source_key = source_key.replace("&widget=true", "").replace("?widget=true", "")
+    if "?" not in source_key:
+        source_key = source_key.rstrip("/") + "/"
+    return source_key
+
+def resolve_content_path(lib_path):
+    '''resolve the real browsable path'''
     if "$INFO" in lib_path and "reload=" not in lib_path:
         lib_path = lib_path.replace("$INFO[Window(Home).Property(", "")
         lib_path = lib_path.replace(")]", "")
@@ -82,3 +166,11 @@ def get_content_path(lib_path):
     if "&reload=" in lib_path:
         lib_path = lib_path.split("&reload=")[0]
     return lib_path
+
+
+def get_addon_version(lib_path):
+    '''helper to get the version of the addon providing the (plugin) path, empty for non-plugin paths'''
+    if not lib_path.startswith("plugin://"):
+        return ""
+    addon_id = lib_path.replace("plugin://", "").split("/")[0].split("?")[0]
+    return xbmc.getInfoLabel("System.AddonVersion(%s)" % addon_id)
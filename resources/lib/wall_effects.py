@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Post-processing effects for the pre-built wall images.
+    Each effect produces an additional variant of the composited wall canvas,
+    so skins do not have to blur, dim or tint the wall at render time.
+    NumPy is used when available, PIL is used as fallback.
+'''
+
+try:
+    from PIL import Image, ImageFilter, ImageEnhance
+except ImportError:
+    Image = None
+
+try:
+    import numpy
+    SUPPORTS_NUMPY = True
+except ImportError:
+    SUPPORTS_NUMPY = False
+
+# all supported wall variants, the name is used in the window property and filename
+WALL_EFFECTS = ["Blur", "Dim", "Vignette", "Tint"]
+
+DIM_FACTOR = 0.5
+VIGNETTE_STRENGTH = 0.8
+TINT_ALPHA = 0.35
+DEFAULT_TINT_COLOR = (26, 58, 90)
+
+
+def parse_color(color):
+    '''parse a hex color string (RRGGBB or AARRGGBB as used by kodi) into a RGB tuple'''
+    try:
+        color = color.strip().lstrip("#")
+        if len(color) == 8:
+            color = color[2:]
+        return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+    except Exception:
+        return DEFAULT_TINT_COLOR
+
+
+def apply_effect(img, effect, tint_color=DEFAULT_TINT_COLOR):
+    '''returns a new RGB image with the given effect applied to the wall canvas'''
+    if effect == "Blur":
+        return img.filter(ImageFilter.GaussianBlur(radius=max(img.size) / 200.0))
+    if effect == "Dim":
+        return dim(img)
+    if effect == "Vignette":
+        return vignette(img)
+    if effect == "Tint":
+        return tint(img, tint_color)
+    return img
+
+
+def dim(img):
+    '''darken the image'''
+    if SUPPORTS_NUMPY:
+        arr = numpy.asarray(img, dtype=numpy.float32) * DIM_FACTOR
+        return Image.fromarray(arr.astype(numpy.uint8), "RGB")
+    return ImageEnhance.Brightness(img).enhance(DIM_FACTOR)
+
+
+def vignette(img):
+    '''darken the image towards the edges'''
+    width, height = img.size
+    if SUPPORTS_NUMPY:
+        rows, cols = numpy.ogrid[0:height, 0:width]
+        # normalized distance to the center, 1.0 at the corners
+        dist = numpy.sqrt(((cols - width / 2.0) / (width / 2.0)) ** 2 +
+                          ((rows - height / 2.0) / (height / 2.0)) ** 2) / numpy.sqrt(2)
+        factor = 1.0 - VIGNETTE_STRENGTH * numpy.clip(dist, 0.0, 1.0) ** 2
+        arr = numpy.asarray(img, dtype=numpy.float32) * factor[:, :, numpy.newaxis]
+        return Image.fromarray(arr.astype(numpy.uint8), "RGB")
+    # radial gradient is black in the center and white at the edges
+    mask = Image.radial_gradient("L").resize(img.size)
+    mask = mask.point(lambda value: int(value * VIGNETTE_STRENGTH))
+    return Image.composite(Image.new("RGB", img.size, (0, 0, 0)), img, mask)
+
+
+def tint(img, tint_color):
+    '''blend the image with the tint color'''
+    if SUPPORTS_NUMPY:
+        arr = numpy.asarray(img, dtype=numpy.float32)
+        arr = arr * (1.0 - TINT_ALPHA) + numpy.array(tint_color, dtype=numpy.float32) * TINT_ALPHA
+        return Image.fromarray(arr.astype(numpy.uint8), "RGB")
+    return Image.blend(img, Image.new("RGB", img.size, tint_color), TINT_ALPHA)
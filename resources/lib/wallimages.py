@@ -9,13 +9,24 @@
 '''
 
 from .utils import log_msg, log_exception
+from .jobworker import JobWorker
+from .wall_effects import WALL_EFFECTS, DEFAULT_TINT_COLOR, apply_effect
 import xbmc
 import xbmcvfs
 import random
 import io
 import sys
+import os
+import time
+import threading
 
 WALLS_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/wall_backgrounds/"
+WALLS_LASTUSED_CACHE = "skinhelper.backgrounds.walls.lastused"
+WALLS_CANVASES_CACHE = "skinhelper.backgrounds.walls.canvases"
+WALLS_CLEANUP_INTERVAL = 3600  # run the wall cleanup at most once per hour
+WALLS_MAX_AGE = 30 * 24 * 3600  # walls which have not been used for this time are removed from disk
+WALLS_INUSE_TIME = 600  # walls published for the skin within this time are considered in use
+SHARED_WALLS_MAX_AGE = 7 * 24 * 3600  # walls in the shared store older than this are built again
 
 # IMPORT PIL/PILLOW ###################################
 SUPPORTS_PIL = False
@@ -27,19 +38,96 @@ if sys.platform.startswith('win32'):
     del TMP
     SUPPORTS_PIL = True
 
+SUPPORTS_WEBP = False
+if SUPPORTS_PIL:
+    try:
+        from PIL import features
+        SUPPORTS_WEBP = features.check("webp")
+    except Exception:
+        pass
+
+# wall geometry for each art type: columns, rows, image width, image height (at 1080p)
+WALL_GEOMETRY = {
+    "thumb": (11, 7, 260, 260),  # square images
+    "poster": (15, 5, 128, 216),  # poster images
+    "fanart": (8, 8, 240, 135)  # landscaped images
+}
+
 class WallImages():
     '''Generate wall images from collection of images'''
     exit = False
-    build_busy = {}
     max_wallimages = 20
-    all_wall_images = {}
-    manual_walls = {}
+    wall_encoder = "jpeg"
+    wall_quality = 85
+    wall_progressive = False
+    wall_optimize = False
+    wall_effects = []  # enabled post-processing variants, see wall_effects.WALL_EFFECTS
+    wall_tint_color = DEFAULT_TINT_COLOR
+    wall_disk_budget = 0  # maximum size in bytes of the wall_backgrounds directory, 0 for unlimited
+    last_cleanup = 0
+    wall_source_images = 250  # number of unique source images to collect for each art type
+    wall_source_max_items = 1000  # never list more items than this from a single library path
 
     def __init__(self, bgupdater):
         self.bgupdater = bgupdater
+        self.worker = JobWorker("WallWorker", progress_callback=self.report_progress)
+        self.last_used = {}  # win_prop --> last time the skin actually used the wall
+        self.max_canvases = None  # number of canvases per wall which fits the disk budget, None if unlimited
+        self.lock = threading.Lock()  # protects the dicts below, they're used by the worker and the service
+        self.all_wall_images = {}
+        self.manual_walls = {}
+        self.manual_wall_slots = {}  # win_prop --> ManualWallSlots
+
+    def stop(self):
+        '''stop the wall worker, an in-flight build is cancelled'''
+        self.exit = True
+        self.worker.stop()
+
+    def pause(self):
+        '''pause the in-flight wall build (e.g. when playback starts)'''
+        self.worker.pause()
+
+    def resume(self):
+        '''resume the paused wall build'''
+        self.worker.resume()
+
+    def report_progress(self, job_key, progress):
+        '''report the progress of the running wall job in window props'''
+        if progress < 100:
+            self.bgupdater.win.setProperty("SkinHelper.WallBackgrounds.Job", job_key)
+            self.bgupdater.win.setProperty("SkinHelper.WallBackgrounds.Progress", str(progress))
+        else:
+            self.bgupdater.win.clearProperty("SkinHelper.WallBackgrounds.Job")
+            self.bgupdater.win.clearProperty("SkinHelper.WallBackgrounds.Progress")
 
     def update_wallbackgrounds(self):
-        '''generates wall images from collection of images from the library'''
+        '''generates wall images from collection of images from the library
+           by queueing wall jobs on the wall worker, jobs which are already queued or running are collapsed'''
+        if self.exit:
+            return
+        if not self.worker.ident:
+            self.worker.start()
+        for lib_path, walls in self.get_walls():
+            # rotating already built walls is cheap so those jobs go first
+            if all(self.is_wall_cached(wall[0]) for wall in walls):
+                priority = 0
+            else:
+                priority = 10
+            self.worker.add_job("walls:%s" % lib_path, self.update_wall_backgrounds, (lib_path, walls), priority)
+        # cleanup of the wall_backgrounds directory runs with the lowest priority
+        if time.time() - self.last_cleanup > WALLS_CLEANUP_INTERVAL:
+            self.last_cleanup = time.time()
+            self.worker.add_job("walls:cleanup", self.cleanup_walls, priority=100)
+
+    def interrupted(self, job=None):
+        '''check if the current wall work should stop, blocks while the worker is paused'''
+        if job:
+            return not job.checkpoint()
+        return self.exit
+
+    def get_walls(self):
+        '''returns the walls to generate grouped by library path, as list of (lib_path, walls) tuples'''
+        result = []
         if self.max_wallimages and SUPPORTS_PIL:
             walls = []
             walls.append(("SkinHelper.AllMoviesBackground.Wall", "videodb://movies/titles/", "fanart"))
@@ -48,12 +136,41 @@ class WallImages():
             walls.append(("SkinHelper.AllMusicSongsBackground.Wall", "musicdb://songs/", "thumb"))
             walls.append(("SkinHelper.AllTvShowsBackground.Wall", "videodb://tvshows/titles/", "fanart"))
             walls.append(("SkinHelper.AllTvShowsBackground.Poster.Wall", "videodb://tvshows/titles/", "poster"))
-            # get the wall images...
+            # group the walls by library path so each path is only listed once for all art types
+            lib_paths = []
+            walls_by_path = {}
             for wall in walls:
-                if not self.exit:
-                    self.update_wall_background(wall)
+                if wall[1] not in walls_by_path:
+                    lib_paths.append(wall[1])
+                    walls_by_path[wall[1]] = []
+                walls_by_path[wall[1]].append(wall)
+            for lib_path in lib_paths:
+                result.append((lib_path, walls_by_path[lib_path]))
+        return result
 
-    def update_wall_background(self, wall_tuple):
+    def update_wall_backgrounds(self, job, lib_path, walls):
+        '''update all wall backgrounds which share the same library path'''
+        # only fetch the art types for walls which are not yet cached in memory
+        arttypes = [wall[2] for wall in walls if not self.is_wall_cached(wall[0])]
+        images = {}
+        if job:
+            job.set_steps(len(walls))
+        if arttypes:
+            images = self.get_images_from_vfspath(lib_path, arttypes, job)
+        for wall in walls:
+            if self.interrupted(job):
+                break
+            self.update_wall_background(wall, images.get(wall[2], []), job)
+            if job:
+                job.next_step()
+
+    def is_wall_cached(self, wall_win_prop):
+        '''check if the wall images for the given wall are already cached in memory'''
+        with self.lock:
+            cached = wall_win_prop in self.all_wall_images
+        return cached and xbmcvfs.exists(WALLS_PATH)
+
+    def update_wall_background(self, wall_tuple, images=None, job=None):
         '''update a single wall background'''
 
         wall_library_path = wall_tuple[1]
@@ -61,34 +178,40 @@ class WallImages():
         wall_win_prop_bw = wall_win_prop + ".BW"
         wall_type = wall_tuple[2]
         wall_images = []
-        if wall_win_prop in self.all_wall_images and xbmcvfs.exists(WALLS_PATH):
+        if self.is_wall_cached(wall_win_prop):
             # the wall images are already cached in memory
-            wall_images = self.all_wall_images[wall_win_prop]
+            with self.lock:
+                wall_images = self.all_wall_images.get(wall_win_prop, [])
         else:
             # no wall images in cache, we must retrieve them
-            images = self.get_images_from_vfspath(wall_library_path, wall_type)
+            if images is None:
+                images = self.get_images_from_vfspath(wall_library_path, [wall_type], job).get(wall_type, [])
             if images:
-                wall_images = self.get_wallimages(wall_win_prop, images, wall_type)
-                self.all_wall_images[wall_win_prop] = wall_images
+                wall_images = self.get_wallimages(wall_win_prop, images, wall_type, job)
+                if not self.interrupted(job):
+                    with self.lock:
+                        self.all_wall_images[wall_win_prop] = wall_images
         if wall_images:
             # we have some wall images, select a random one and set as window prop
             wall_image = random.choice(wall_images)
             if wall_image:
                 self.bgupdater.win.setProperty(wall_win_prop, wall_image["wall"])
                 self.bgupdater.win.setProperty(wall_win_prop_bw, wall_image["wallbw"])
+                if self.bgupdater.demand.is_in_use(wall_win_prop):
+                    # walls the skin declared it does not use are not kept alive by publishing them
+                    self.last_used[wall_win_prop] = time.time()
+                for effect in WALL_EFFECTS:
+                    if wall_image.get(effect):
+                        self.bgupdater.win.setProperty("%s.%s" % (wall_win_prop, effect), wall_image[effect])
+                    else:
+                        self.bgupdater.win.clearProperty("%s.%s" % (wall_win_prop, effect))
 
-    def get_wallimages(self, win_prop, images, art_type="fanart"):
+    def get_wallimages(self, win_prop, images, art_type="fanart", job=None):
         '''gets or builds all wall images for the collection'''
         wall_images = []
 
-        if self.build_busy.get(win_prop, False):
-            # there is already a build in progress for this wall, skip...
-            log_msg("Build WALL %s skipped - another build in progress" % win_prop)
+        if self.interrupted(job):
             return wall_images
-        elif self.exit:
-            return wall_images
-        else:
-            self.build_busy[win_prop] = True
 
         # if there is a big change in number of items we force a rebuild
         lastcount = 0
@@ -97,10 +220,11 @@ class WallImages():
         last_count_setting = self.bgupdater.addon.getSetting(win_prop)
         if last_count_setting:
             lastcount = int(last_count_setting)
-        if (lastcount + 10) < curcount:
+        if (lastcount + 10) < curcount and self.bgupdater.governor.allow_heavy_work():
+            # the rebuild is postponed (by not storing the new count) while kodi is not idle
             force_rebuild = True
             self.bgupdater.addon.setSetting(win_prop, str(curcount))
-        log_msg("%s --> curcount: %s - lastcount: %s" % (win_prop, curcount, lastcount))
+        log_msg("%s --> curcount: %s - lastcount: %s", xbmc.LOGDEBUG, win_prop, curcount, lastcount)
 
         # check if our path exists
         if not xbmcvfs.exists(WALLS_PATH):
@@ -109,55 +233,109 @@ class WallImages():
 
         # reuse the existing images - only rebuild if really needed
         if not force_rebuild:
+            # walls published by another client in the shared store are copied to our walls path
+            self.fetch_shared_walls(win_prop)
             files = xbmcvfs.listdir(WALLS_PATH)[1]
+            max_canvases = self.get_max_canvases()
             for file in files:
                 # return color and bw image combined - only if both are found
                 color_path = WALLS_PATH + file.replace("_BW", "")
                 black_path = WALLS_PATH + file
-                if file.startswith("%s_BW." % win_prop) and xbmcvfs.exists(color_path):
-                    wall_images.append(
-                        {
-                            "wallbw": black_path,
-                            "wall": color_path
-                        })
+                if not file.startswith("%s_BW." % win_prop) or (parse_wall_filename(file)[2] or 0) >= max_canvases:
+                    # the canvases which do not fit the disk budget are removed by the cleanup
+                    continue
+                if xbmcvfs.exists(color_path):
+                    wall_image = {
+                        "wallbw": black_path,
+                        "wall": color_path
+                    }
+                    # all enabled variants must be present too
+                    for effect in self.wall_effects:
+                        effect_path = WALLS_PATH + file.replace("_BW.", "_%s." % effect, 1)
+                        if not xbmcvfs.exists(effect_path):
+                            wall_image = None
+                            break
+                        wall_image[effect] = effect_path
+                    if wall_image:
+                        wall_images.append(wall_image)
 
         # skip if we do not have enough source images
-        if len(images) < (self.max_wallimages * 2):
+        if len(images) < (self.get_max_canvases() * 2):
             log_msg("Building WALL background skipped - not enough source images")
             return wall_images
 
         # build wall images if we do not already have (enough) wall images prebuilt on the filesystem
-        if len(wall_images) < self.max_wallimages:
-            wall_images = self.build_wallimages(win_prop, images, art_type)
+        if len(wall_images) < self.get_max_canvases():
+            if not self.bgupdater.governor.allow_heavy_work():
+                # new walls are only built while kodi is idle, try again on the next run
+                log_msg("Building WALL background %s postponed until kodi is idle" % win_prop, xbmc.LOGDEBUG)
+                return wall_images
+            wall_images = self.build_shared_wallimages(win_prop, images, art_type, job) or wall_images
 
-        self.build_busy[win_prop] = False
         return wall_images
 
-    def build_wallimages(self, win_prop, wall_images, art_type):
+    def get_max_canvases(self):
+        '''returns the number of canvases to keep for each wall, reduced by the cleanup to fit the disk budget'''
+        if self.max_canvases is None and self.wall_disk_budget:
+            self.max_canvases = self.bgupdater.cache.get(WALLS_CANVASES_CACHE) or 0
+        if self.max_canvases and self.wall_disk_budget:
+            return min(self.max_wallimages, self.max_canvases)
+        return self.max_wallimages
+
+    def get_shared_name(self, win_prop):
+        '''returns the name of the walls of the win_prop in the shared store
+           clients with another resolution, encoder or effects do not share the same walls'''
+        return "walls-%s-%s-%s-%s" % (win_prop, self.get_wall_geometry("fanart")[3],
+                                      self.get_wall_extension(), "+".join(self.wall_effects) or "none")
+
+    def fetch_shared_walls(self, win_prop):
+        '''copy the walls of the win_prop published in the shared store (if any) to our walls path'''
+        shared_store = self.bgupdater.shared_store
+        if not shared_store:
+            return
+        try:
+            if shared_store.fetch(self.get_shared_name(win_prop), xbmcvfs.translatePath(WALLS_PATH),
+                                  SHARED_WALLS_MAX_AGE):
+                log_msg("Using the shared wall images for %s", xbmc.LOGDEBUG, win_prop)
+        except Exception as exc:
+            log_exception(__name__, exc)
+
+    def build_shared_wallimages(self, win_prop, wall_images, art_type, job=None):
+        '''build the wall images and publish them in the shared store
+           only one client builds the walls, the others reuse the published walls on the next run'''
+        shared_store = self.bgupdater.shared_store
+        if not shared_store:
+            return self.build_wallimages(win_prop, wall_images, art_type, job)
+        name = self.get_shared_name(win_prop)
+        try:
+            locked = shared_store.acquire(name)
+        except Exception as exc:
+            # shared store not available, just build our own walls
+            log_exception(__name__, exc)
+            return self.build_wallimages(win_prop, wall_images, art_type, job)
+        if not locked:
+            log_msg("Building WALL background %s postponed - another client is building it" % win_prop)
+            return []
+        try:
+            return_images = self.build_wallimages(win_prop, wall_images, art_type, job)
+            if return_images:
+                try:
+                    shared_store.publish(
+                        name, [path for wall_image in return_images for path in wall_image.values()])
+                except Exception as exc:
+                    log_exception(__name__, exc)
+            return return_images
+        finally:
+            shared_store.release(name)
+
+    def build_wallimages(self, win_prop, wall_images, art_type, job=None):
         '''build wall images with PIL module for the collection'''
         return_images = []
         if not SUPPORTS_PIL:
             log_msg("Wall backgrounds disabled - PIL is not supported on this device!", xbmc.LOGINFO)
             return []
         log_msg("Building Wall background for %s - this might take a while..." % win_prop)
-        if art_type == "thumb":
-            # square images
-            img_columns = 11
-            img_rows = 7
-            img_width = 260
-            img_height = 260
-        elif art_type == "poster":
-            # poster images
-            img_columns = 15
-            img_rows = 5
-            img_width = 128
-            img_height = 216
-        else:
-            # landscaped images
-            img_columns = 8
-            img_rows = 8
-            img_width = 240
-            img_height = 135
+        img_columns, img_rows, img_width, img_height = self.get_wall_geometry(art_type)
         size = img_width, img_height
 
         # build the wall images
@@ -168,19 +346,25 @@ class WallImages():
             while len(wall_images) < images_required:
                 wall_images += wall_images
 
-            for count in range(self.max_wallimages):
-                if self.exit:
+            max_canvases = self.get_max_canvases()
+            for count in range(max_canvases):
+                if self.interrupted(job):
+                    log_msg("Building Wall background %s cancelled" % win_prop)
                     return []
+                if job:
+                    job.set_step_progress(float(count) / max_canvases)
                 random.shuffle(wall_images)
-                img_canvas = Image.new("RGBA", (img_width * img_columns, img_height * img_rows))
+                img_canvas = Image.new("RGB", (img_width * img_columns, img_height * img_rows))
                 img_count = 0
                 for x in range(img_rows):
+                    if self.interrupted(job):
+                        return []
                     for y in range(img_columns):
                         file = xbmcvfs.File(wall_images[img_count])
                         try:
                             img_obj = io.BytesIO(bytearray(file.readBytes()))
                             img = Image.open(img_obj)
-                            xbmc.sleep(500)
+                            self.bgupdater.governor.throttle()
                             img = img.resize(size)
                             img_canvas.paste(img, (y * img_width, x * img_height))
                             del img
@@ -191,78 +375,268 @@ class WallImages():
                             file.close()
                             img_count += 1
 
-                # save the files..
-                out_file = "%s%s.%s.jpg" % (WALLS_PATH, win_prop, count)
+                # save the files.. both variants are encoded from the same composited canvas
+                out_file = "%s%s.%s.%s" % (WALLS_PATH, win_prop, count, self.get_wall_extension())
                 out_file = xbmcvfs.translatePath(out_file)
-                if xbmcvfs.exists(out_file):
-                    xbmcvfs.delete(out_file)
-                    xbmc.sleep(500)
-                img_canvas = img_canvas.convert("RGB")					
-                img_canvas.save(out_file, "JPEG")
-
-                out_file_bw = "%s%s_BW.%s.jpg" % (WALLS_PATH, win_prop, count)
+                self.save_wall_image(img_canvas, out_file)
+                out_file_bw = "%s%s_BW.%s.%s" % (WALLS_PATH, win_prop, count, self.get_wall_extension())
                 out_file_bw = xbmcvfs.translatePath(out_file_bw)
-                if xbmcvfs.exists(out_file_bw):
-                    xbmcvfs.delete(out_file_bw)
-                    xbmc.sleep(500)
-                img_canvas = img_canvas.convert("L")
-                img_canvas.save(out_file_bw, "JPEG")
+                self.save_wall_image(img_canvas.convert("L"), out_file_bw)
+                wall_image = {"wall": out_file, "wallbw": out_file_bw}
+                # post-processing: precompute the enabled effect variants from the canvas
+                for effect in self.wall_effects:
+                    out_file_effect = "%s%s_%s.%s.%s" % (WALLS_PATH, win_prop, effect, count, self.get_wall_extension())
+                    out_file_effect = xbmcvfs.translatePath(out_file_effect)
+                    self.save_wall_image(apply_effect(img_canvas, effect, self.wall_tint_color), out_file_effect)
+                    wall_image[effect] = out_file_effect
                 del img_canvas
                 # add our images to the dict
-                return_images.append({"wall": out_file, "wallbw": out_file_bw})
+                return_images.append(wall_image)
         log_msg("Building Wall background %s DONE" % win_prop)
         return return_images
 
+    def get_wall_geometry(self, art_type):
+        '''returns the wall geometry (columns, rows, image width, image height) for the given art type
+           the image size is scaled from the 1080p base geometry to the display resolution'''
+        img_columns, img_rows, img_width, img_height = WALL_GEOMETRY.get(art_type, WALL_GEOMETRY["fanart"])
+        scale = 1.0
+        try:
+            screen_height = int(xbmc.getInfoLabel("System.ScreenHeight"))
+            scale = min(max(screen_height / 1080.0, 0.5), 2.0)
+        except Exception:
+            pass
+        return img_columns, img_rows, int(img_width * scale), int(img_height * scale)
+
+    def get_wall_extension(self):
+        '''returns the file extension for the selected wall image encoder'''
+        if self.wall_encoder == "webp" and SUPPORTS_WEBP:
+            return "webp"
+        return "jpg"
+
+    def save_wall_image(self, img, out_file):
+        '''save a wall image with the configured encoder settings'''
+        if xbmcvfs.exists(out_file):
+            xbmcvfs.delete(out_file)
+        if self.get_wall_extension() == "webp":
+            img.save(out_file, "WEBP", quality=self.wall_quality, method=4)
+        else:
+            img.save(out_file, "JPEG", quality=self.wall_quality,
+                     progressive=self.wall_progressive, optimize=self.wall_optimize)
+
+    def cleanup_walls(self, job):
+        '''evict wall files which are no longer in use and keep the walls within the disk budget'''
+        if not xbmcvfs.exists(WALLS_PATH):
+            return
+        active_walls = [wall[0] for lib_path, walls in self.get_walls() for wall in walls]
+        variants = ["", "BW"] + self.wall_effects
+        extension = self.get_wall_extension()
+        last_used = self.bgupdater.cache.get(WALLS_LASTUSED_CACHE) or {}
+        last_used.update(self.last_used)
+        now = time.time()
+        deleted = set()
+
+        # collect the wall files on disk, files which do not belong to an active wall are removed directly
+        walls = {}
+        files = xbmcvfs.listdir(WALLS_PATH)[1]
+        job.set_steps(len(files) + 1)
+        for file in files:
+            if not job.checkpoint():
+                return
+            job.next_step()
+            filepath = WALLS_PATH + file
+            win_prop, variant, count, ext = parse_wall_filename(file)
+            if (win_prop not in active_walls or variant not in variants or count is None or
+                    count >= self.max_wallimages or ext != extension):
+                xbmcvfs.delete(filepath)
+                deleted.add(file)
+                continue
+            stat = xbmcvfs.Stat(filepath)
+            if win_prop not in walls:
+                walls[win_prop] = {"files": [], "size": 0, "canvases": {},
+                                   "last_used": last_used.get(win_prop, stat.st_mtime())}
+            walls[win_prop]["files"].append(file)
+            walls[win_prop]["size"] += stat.st_size()
+            walls[win_prop]["canvases"].setdefault(count, []).append(file)
+
+        # remove walls which have not been used for a long time (e.g. removed libraries)
+        for win_prop in list(walls.keys()):
+            if now - walls[win_prop]["last_used"] > WALLS_MAX_AGE:
+                deleted.update(self.delete_wall(win_prop, walls.pop(win_prop)))
+
+        total_size = sum(wall["size"] for wall in walls.values())
+        if self.wall_disk_budget and total_size > self.wall_disk_budget:
+            # evict the least recently used walls until we're within the disk budget
+            for win_prop in sorted(walls.keys(), key=lambda x: walls[x]["last_used"]):
+                if total_size <= self.wall_disk_budget or not job.checkpoint():
+                    break
+                if now - walls[win_prop]["last_used"] < WALLS_INUSE_TIME:
+                    # never remove the walls which are actually in use
+                    continue
+                total_size -= walls[win_prop]["size"]
+                deleted.update(self.delete_wall(win_prop, walls.pop(win_prop)))
+        if self.wall_disk_budget and walls:
+            # the walls in use must fit the budget too, so reduce the number of canvases of each wall
+            num_canvases = sum(len(wall["canvases"]) for wall in walls.values())
+            canvas_size = float(total_size) / num_canvases
+            max_canvases = int(self.wall_disk_budget / (canvas_size * len(walls)))
+            max_canvases = max(1, min(self.max_wallimages, max_canvases))
+            if max_canvases != self.get_max_canvases():
+                log_msg("Wall backgrounds - keeping %s images per wall to fit the disk budget (%s bytes)"
+                        % (max_canvases, self.wall_disk_budget))
+            for win_prop, wall in walls.items():
+                for count, canvas_files in wall["canvases"].items():
+                    if count >= max_canvases:
+                        for file in canvas_files:
+                            xbmcvfs.delete(WALLS_PATH + file)
+                        deleted.update(canvas_files)
+            self.max_canvases = max_canvases
+            self.bgupdater.cache.set(WALLS_CANVASES_CACHE, max_canvases)
+
+        # forget the wall images which were deleted so they are not published anymore
+        with self.lock:
+            for win_prop in list(self.all_wall_images.keys()):
+                wall_images = [wall_image for wall_image in self.all_wall_images[win_prop]
+                               if not any(os.path.basename(path) in deleted for path in wall_image.values())]
+                if wall_images:
+                    self.all_wall_images[win_prop] = wall_images
+                else:
+                    del self.all_wall_images[win_prop]
+        self.bgupdater.cache.set(WALLS_LASTUSED_CACHE,
+                                 dict((key, value) for key, value in last_used.items() if key in active_walls))
+        if deleted:
+            log_msg("Wall backgrounds cleanup - removed %s files" % len(deleted))
+
+    @staticmethod
+    def delete_wall(win_prop, wall):
+        '''delete all files of a wall from disk, returns the deleted filenames'''
+        log_msg("Wall backgrounds cleanup - removing %s" % win_prop)
+        for file in wall["files"]:
+            xbmcvfs.delete(WALLS_PATH + file)
+        return wall["files"]
+
     def set_manualwall(self, win_prop, limit=20):
-        '''set a manual wall by providing the skinner randomly changing images in window props'''
-        images = self.bgupdater.get_images_from_vfspath(self.bgupdater.all_backgrounds_keys[win_prop])
-        if images:
-            if self.bgupdater.win.getProperty("%s.Wall.0" % win_prop):
-                # 1st run was already done so only refresh one random image in the collection...
-                image = random.choice(images)
-                for key, value in image.items():
-                    random_int = random.randint(0, limit)
-                    if key == "fanart":
-                        self.bgupdater.win.setProperty("%s.Wall.%s" % (win_prop, random_int), value)
-                    else:
-                        self.bgupdater.win.setProperty("%s.Wall.%s.%s" % (win_prop, random_int, key), value)
+        '''set a manual wall by providing the skinner randomly changing images in window props
+           the images are sampled from the pool of the (rotating) background, no library fetch needed'''
+        if limit <= 0:
+            return
+        slots = self.manual_wall_slots.get(win_prop)
+        if not slots or slots.limit != limit:
+            # first run: set all images
+            image = self.sample_manualwall_image(win_prop)
+            if not image:
+                # the pool of the background is not filled yet
+                return
+            slots = self.manual_wall_slots[win_prop] = ManualWallSlots(limit)
+            self.set_manualwall_slot(win_prop, slots, 0, image)
+            for slot in range(1, limit):
+                self.set_manualwall_slot(win_prop, slots, slot, self.sample_manualwall_image(win_prop))
+        else:
+            # 1st run was already done so only refresh the next slot of the random slot order
+            image = self.sample_manualwall_image(win_prop)
+            if image:
+                self.set_manualwall_slot(win_prop, slots, slots.next_slot(), image)
+
+    def sample_manualwall_image(self, win_prop):
+        '''returns a random image from the pool of the background of the manual wall'''
+        return self.bgupdater.pool_store.sample("%s.Wall" % win_prop, win_prop)
+
+    def set_manualwall_slot(self, win_prop, slots, slot, image):
+        '''set the window props of a single slot of a manual wall'''
+        if not image:
+            return
+        for key, value in image.items():
+            if key == "fanart":
+                self.bgupdater.win.setProperty("%s.Wall.%s" % (win_prop, slot), value)
             else:
-                # first run: set all images
-                for i in range(limit):
-                    image = random.choice(images)
-                    for key, value in image.items():
-                        if key == "fanart":
-                            self.bgupdater.win.setProperty("%s.Wall.%s" % (win_prop, i), value)
-                        else:
-                            self.bgupdater.win.setProperty("%s.Wall.%s.%s" % (win_prop, i, key), value)
+                self.bgupdater.win.setProperty("%s.Wall.%s.%s" % (win_prop, slot, key), value)
+        # clear the props of the previous image in this slot which the new image does not have
+        for key in slots.keys[slot] - set(image.keys()):
+            if key != "fanart":
+                self.bgupdater.win.clearProperty("%s.Wall.%s.%s" % (win_prop, slot, key))
+        slots.keys[slot] = set(image.keys())
 
     def update_manualwalls(self):
         '''manual wall images, provides a collection of images which are randomly changing'''
-        for key, value in self.manual_walls.items():
+        with self.lock:
+            manual_walls = list(self.manual_walls.items())
+        for key, value in manual_walls:
             self.set_manualwall(key, value)
 
-    def get_images_from_vfspath(self, lib_path, arttype):
-        '''get all (unique and existing) images from the given vfs path to build the image wall'''
-        result = []
+    def get_images_from_vfspath(self, lib_path, arttypes, job=None):
+        '''get a random selection of (unique and existing) images of each art type from the given vfs path
+           the path is listed once with a random sort for all art types, paging a random sort is not stable
+           between the calls (the pages would overlap and skip items)'''
+        result = dict((arttype, []) for arttype in arttypes)
+        seen = dict((arttype, set()) for arttype in arttypes)
         items = self.bgupdater.mutils.kodidb.get_json(
             "Files.GetDirectory", returntype="", optparam=(
                 "directory", lib_path), fields=[
                 "art", "thumbnail", "fanart"], sort={
-                "method": "random", "order": "descending"}, limits=(0,1000))
-
+                "method": "random", "order": "descending"},
+            limits=(0, self.wall_source_max_items))
         for media in items:
-            image = None
-            if media.get('art', {}).get(arttype):
-                image = media['art'][arttype]
-            elif media.get('art', {}).get('tvshow.%s' % arttype):
-                image = media['art']['tvshow.%s' % arttype]
-            elif media.get('art', {}).get('artist.%s' % arttype):
-                image = media['art']['artist.%s' % arttype]
-            elif arttype == "thumb" and media.get("thumbnail"):
-                image = media["thumbnail"]
-            elif arttype == "fanart" and media.get("fanart"):
-                image = media["fanart"]
-            image = self.bgupdater.mutils.get_clean_image(image)
-            if image and image not in result and xbmcvfs.exists(image):
-                result.append(image)
+            if self.interrupted(job):
+                break
+            for arttype in arttypes:
+                if len(result[arttype]) >= self.wall_source_images:
+                    continue
+                image = self.get_media_art(media, arttype)
+                if not image or image in seen[arttype]:
+                    continue
+                seen[arttype].add(image)
+                if xbmcvfs.exists(image):
+                    result[arttype].append(image)
         return result
+
+    def get_media_art(self, media, arttype):
+        '''get the (cleaned) image of the given art type for a media item'''
+        image = None
+        if media.get('art', {}).get(arttype):
+            image = media['art'][arttype]
+        elif media.get('art', {}).get('tvshow.%s' % arttype):
+            image = media['art']['tvshow.%s' % arttype]
+        elif media.get('art', {}).get('artist.%s' % arttype):
+            image = media['art']['artist.%s' % arttype]
+        elif arttype == "thumb" and media.get("thumbnail"):
+            image = media["thumbnail"]
+        elif arttype == "fanart" and media.get("fanart"):
+            image = media["fanart"]
+        return self.bgupdater.mutils.get_clean_image(image)
+
+
+class ManualWallSlots(object):
+    '''the slots of a manual wall, the slots are refreshed one at a time in a random permutation
+       so every slot is refreshed once before any slot is refreshed again'''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.keys = [set() for _ in range(limit)]  # the image keys set for each slot
+        self.order = []
+        self.position = 0
+
+    def next_slot(self):
+        '''returns the next slot to refresh'''
+        if self.position >= len(self.order):
+            self.order = list(range(self.limit))
+            random.shuffle(self.order)
+            self.position = 0
+        slot = self.order[self.position]
+        self.position += 1
+        return slot
+
+
+def parse_wall_filename(filename):
+    '''parse a wall filename (win_prop[_variant].count.ext) into a (win_prop, variant, count, ext) tuple'''
+    try:
+        name, ext = filename.rsplit(".", 1)
+        win_prop, count = name.rsplit(".", 1)
+        count = int(count)
+    except ValueError:
+        return filename, "", None, ""
+    variant = ""
+    if "_" in win_prop:
+        base, suffix = win_prop.rsplit("_", 1)
+        if suffix in ["BW"] + WALL_EFFECTS:
+            win_prop = base
+            variant = suffix
+    return win_prop, variant, count, ext
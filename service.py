@@ -7,10 +7,11 @@
 '''
 
 from resources.lib.backgrounds_updater import BackgroundsUpdater
+from resources.lib.kodimonitor import KodiMonitor
 from resources.lib.utils import log_msg
 import xbmc
 
-kodimonitor = xbmc.Monitor()
+kodimonitor = KodiMonitor()
 
 # run the background service
 backgrounds_updater = BackgroundsUpdater(kodimonitor=kodimonitor)
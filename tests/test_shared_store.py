@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.backgrounds
+    Tests for the shared artefact store, the other client runs in its own process like a second Kodi instance.
+    Run from the root of the addon: python -m unittest discover tests
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from resources.lib.shared_store import SharedStore, MANIFEST
+
+CLIENT_SCRIPT = '''
+import json, sys
+from resources.lib.shared_store import SharedStore
+path, client_id, action, name, files = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:]
+store = SharedStore(path, client_id)
+if action == "acquire":
+    print(json.dumps(store.acquire(name)))
+elif action == "publish":
+    print(json.dumps(store.publish(name, files, data={"count": len(files)})["client"]))
+'''
+
+
+class SharedStoreTest(unittest.TestCase):
+    '''two clients sharing one store directory'''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "store")
+        self.store = SharedStore(self.path, "client-a", lock_timeout=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run_client(self, action, name, *files):
+        '''run the other client in its own process, returns the result of the action'''
+        output = subprocess.check_output([sys.executable, "-c", CLIENT_SCRIPT, self.path, "client-b",
+                                          action, name] + list(files), cwd=ROOT)
+        return json.loads(output.decode("utf-8"))
+
+    def write_file(self, filename, data):
+        '''write a local file to publish'''
+        filename = os.path.join(self.tmp_dir, filename)
+        with open(filename, "wb") as file:
+            file.write(data)
+        return filename
+
+    def test_lock_contention(self):
+        self.assertTrue(self.store.acquire("walls"))
+        self.assertFalse(self.run_client("acquire", "walls"))
+        self.store.release("walls")
+        self.assertTrue(self.run_client("acquire", "walls"))
+        self.assertFalse(self.store.acquire("walls"))
+
+    def test_stale_lock_takeover(self):
+        # the other client exits while holding the lock, like a crashed kodi instance
+        self.assertTrue(self.run_client("acquire", "walls"))
+        self.assertFalse(self.store.acquire("walls"))
+        lock_file = os.path.join(self.path, "walls.lock")
+        os.utime(lock_file, (time.time() - 120, time.time() - 120))
+        self.assertTrue(self.store.acquire("walls"))
+        with open(lock_file) as file:
+            self.assertEqual(json.load(file)["client"], "client-a")
+
+    def test_fetch_published(self):
+        self.assertIsNone(self.store.get_manifest_time("walls"))
+        self.run_client("publish", "walls", self.write_file("wall.0.jpg", b"wall image"))
+        self.assertIsNotNone(self.store.get_manifest_time("walls"))
+        dest_dir = os.path.join(self.tmp_dir, "client-a")
+        manifest = self.store.fetch("walls", dest_dir)
+        self.assertEqual(manifest["client"], "client-b")
+        self.assertEqual(manifest["data"], {"count": 1})
+        with open(os.path.join(dest_dir, "wall.0.jpg"), "rb") as file:
+            self.assertEqual(file.read(), b"wall image")
+
+    def test_hash_mismatch(self):
+        self.run_client("publish", "walls", self.write_file("wall.0.jpg", b"wall image"))
+        # the file in the store does not match the sha1 in the manifest (e.g. partially written)
+        with open(os.path.join(self.store.get_dir("walls"), "wall.0.jpg"), "wb") as file:
+            file.write(b"partially written wall")
+        dest_dir = os.path.join(self.tmp_dir, "client-a")
+        self.assertIsNone(self.store.fetch("walls", dest_dir))
+        self.assertFalse(os.path.exists(os.path.join(dest_dir, "wall.0.jpg")))
+        self.assertTrue(os.path.exists(os.path.join(self.store.get_dir("walls"), MANIFEST)))
+
+
+if __name__ == "__main__":
+    unittest.main()